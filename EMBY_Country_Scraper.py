@@ -6,14 +6,18 @@ Emby 国家标签抓取器
 """
 import os
 import csv
-import json
 import logging
 import requests
-from typing import List, Dict, Any, Optional
-from datetime import datetime, date, timedelta
-from dateutil import parser
+import pandas as pd
+from typing import List, Dict, Any, Optional, Iterator, Iterable
 from configparser import ConfigParser
 from utils import EmbyAPI
+from tmdb_api import get_tmdb_api_from_config
+from scan_state import IncrementalScanState, FINGERPRINT_FIELDS
+from writeback_buffer import get_write_buffer_from_config
+from sharding import split_shards
+from columnar_planner import plan_tag_additions, COLUMNAR_BATCH_SIZE
+from resources import EMBY_ITEMS, TMDB, EXCLUSIVE
 
 # 配置日志
 logging.basicConfig(
@@ -341,168 +345,153 @@ LANGUAGE_DICT = {
     'vls': '西佛兰德语',
 }
 
+# Emby ProductionLocations（TMDB英文国家名）到国家代码的映射
+COUNTRY_NAME_DICT = {
+    'South Korea': 'KR',
+    'Korea': 'KR',
+    'Republic of Korea': 'KR',
+    'China': 'CN',
+    'Hong Kong': 'HK',
+    'Taiwan': 'TW',
+    'Japan': 'JP',
+    'United States of America': 'US',
+    'United States': 'US',
+    'USA': 'US',
+    'United Kingdom': 'GB',
+    'UK': 'GB',
+    'France': 'FR',
+    'Germany': 'DE',
+    'India': 'IN',
+    'Russia': 'RU',
+    'Russian Federation': 'RU',
+    'Canada': 'CA',
+    'Australia': 'AU',
+    'Italy': 'IT',
+    'Spain': 'ES',
+    'Brazil': 'BR',
+    'Mexico': 'MX',
+    'Thailand': 'TH',
+    'Singapore': 'SG',
+    'Malaysia': 'MY',
+    'Indonesia': 'ID',
+    'Philippines': 'PH',
+    'Vietnam': 'VN',
+    'Viet Nam': 'VN',
+    'Turkey': 'TR',
+    'Türkiye': 'TR',
+    'Netherlands': 'NL',
+    'Sweden': 'SE',
+    'Norway': 'NO',
+    'Denmark': 'DK',
+    'Finland': 'FI',
+    'Poland': 'PL',
+    'Czech Republic': 'CZ',
+    'Czechia': 'CZ',
+    'Hungary': 'HU',
+    'Austria': 'AT',
+    'Switzerland': 'CH',
+    'Belgium': 'BE',
+    'Portugal': 'PT',
+    'Greece': 'GR',
+    'Ireland': 'IE',
+    'New Zealand': 'NZ',
+    'South Africa': 'ZA',
+    'Egypt': 'EG',
+    'Morocco': 'MA',
+    'Nigeria': 'NG',
+    'Kenya': 'KE',
+    'Israel': 'IL',
+    'United Arab Emirates': 'AE',
+    'Saudi Arabia': 'SA',
+    'Qatar': 'QA',
+    'Kuwait': 'KW',
+    'Bahrain': 'BH',
+    'Oman': 'OM',
+    'Jordan': 'JO',
+    'Lebanon': 'LB',
+    'Syria': 'SY',
+    'Syrian Arab Republic': 'SY',
+    'Iraq': 'IQ',
+    'Iran': 'IR',
+    'Pakistan': 'PK',
+    'Bangladesh': 'BD',
+    'Sri Lanka': 'LK',
+    'Nepal': 'NP',
+    'Myanmar': 'MM',
+    'Cambodia': 'KH',
+    'Laos': 'LA',
+    "Lao People's Democratic Republic": 'LA',
+    'Mongolia': 'MN',
+    'Kazakhstan': 'KZ',
+    'Uzbekistan': 'UZ',
+    'Kyrgyzstan': 'KG',
+    'Kyrgyz Republic': 'KG',
+    'Tajikistan': 'TJ',
+    'Turkmenistan': 'TM',
+    'Azerbaijan': 'AZ',
+    'Georgia': 'GE',
+    'Armenia': 'AM',
+    'Belarus': 'BY',
+    'Moldova': 'MD',
+    'Ukraine': 'UA',
+    'Romania': 'RO',
+    'Bulgaria': 'BG',
+    'Croatia': 'HR',
+    'Slovenia': 'SI',
+    'Serbia': 'RS',
+    'Montenegro': 'ME',
+    'Bosnia and Herzegovina': 'BA',
+    'North Macedonia': 'MK',
+    'Macedonia': 'MK',
+    'Albania': 'AL',
+    'Kosovo': 'XK',
+    'Malta': 'MT',
+    'Cyprus': 'CY',
+    'Iceland': 'IS',
+    'Luxembourg': 'LU',
+    'Liechtenstein': 'LI',
+    'Monaco': 'MC',
+    'Andorra': 'AD',
+    'San Marino': 'SM',
+    'Holy See': 'VA',
+    'Vatican City': 'VA',
+    'Slovakia': 'SK',
+    'Lithuania': 'LT',
+    'Latvia': 'LV',
+    'Estonia': 'EE',
+}
+
 DEFAULT_COUNTRY = '其他国家'
 DEFAULT_LANGUAGE = '其他语种'
 
-class JsonDataBase:
-    """JSON数据库类，用于缓存TMDB数据"""
-    
-    def __init__(self, name, prefix='', db_type='dict', workdir=None):
-        self.file_name = f'{prefix}_{name}.json' if prefix else f'{name}.json'
-        self.file_path = os.path.join(workdir, self.file_name) if workdir else self.file_name
-        self.db_type = db_type
-        self.data = self.load()
-
-    def load(self, encoding='utf-8'):
-        try:
-            with open(self.file_path, encoding=encoding) as f:
-                _json = json.load(f)
-        except (FileNotFoundError, ValueError):
-            return dict(list=[], dict={})[self.db_type]
-        else:
-            return _json
-
-    def dump(self, obj, encoding='utf-8'):
-        with open(self.file_path, 'w', encoding=encoding) as f:
-            json.dump(obj, f, indent=2, ensure_ascii=False)
-
-    def save(self):
-        self.dump(self.data)
-
-class TmdbDataBase(JsonDataBase):
-    """TMDB数据缓存类"""
-    
-    def __getitem__(self, tmdb_id):
-        data = self.data.get(tmdb_id)
-        if not data:
-            return
-        
-        air_date = date.today()
-        try:
-            air_date = parser.parse(data['premiere_date']).date()
-        except Exception:
-            pass
-        
-        today = date.today()
-        if air_date + timedelta(days=30) > today:
-            expire_day = 3
-        elif air_date + timedelta(days=90) > today:
-            expire_day = 15
-        elif air_date + timedelta(days=365) > today:
-            expire_day = 30
-        else:
-            expire_day = 30
-        
-        update_date = date.fromisoformat(data['update_date'])
-        if update_date + timedelta(days=expire_day) < today:
-            return
-        
-        return data
-
-    def __setitem__(self, key, value):
-        self.data[key] = value
-        self.save()
-
-    def clean_not_trust_data(self, expire_days=7, min_trust=0.5):
-        """清理不可信数据"""
-        today = date.today()
-        keys_to_remove = []
-        for key, value in self.data.items():
-            update_date = date.fromisoformat(value['update_date'])
-            if update_date + timedelta(days=expire_days) < today:
-                keys_to_remove.append(key)
-        
-        for key in keys_to_remove:
-            del self.data[key]
-        self.save()
-
-    def save_country(self, tmdb_id, premiere_date, name, production_countries, spoken_languages):
-        """保存国家数据"""
-        self.data[tmdb_id] = {
-            'premiere_date': premiere_date,
-            'name': name,
-            'production_countries': production_countries,
-            'spoken_languages': spoken_languages,
-            'update_date': date.today().isoformat()
-        }
-        self.save()
+# 国家/语言信息来源
+SOURCE_LABELS = {
+    'emby': 'Emby',
+    'cache': '缓存',
+    'tmdb': 'TMDB',
+}
 
-class TMDBAPI:
-    """TMDB API接口类"""
-    
-    def __init__(self):
-        self.api_key = config.get('TMDB', 'tmdb_api_key')
-        self.base_url = config.get('TMDB', 'tmdb_api_base_url', fallback='https://api.themoviedb.org/3')
-        
-        # 检查API密钥
-        if not self.api_key:
-            logging.error("❌ TMDB API密钥未设置！请在config.conf的[TMDB]部分设置tmdb_api_key")
-            return
-        
-        # 检查API密钥格式
-        if not self.api_key.startswith('eyJ') and len(self.api_key) < 100:
-            logging.warning("⚠️ TMDB API密钥格式可能不正确，应该是Bearer Token格式（以eyJ开头的长字符串）")
-        
-        self.session = requests.Session()
-        self.session.headers.update({
-            "accept": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        })
-        
-        logging.info(f"🔑 TMDB API密钥已配置: {self.api_key[:20]}...")
-        logging.info(f"🌐 TMDB API基础URL: {self.base_url}")
-    
-    def get_movie_info(self, tmdb_id: str) -> Optional[Dict]:
-        """获取电影信息"""
-        if not self.api_key:
-            logging.error("❌ TMDB API密钥未设置，无法请求TMDB API")
-            return None
-            
-        try:
-            url = f"{self.base_url}/movie/{tmdb_id}?language=zh-CN"
-            logging.info(f"🔗 TMDB API请求URL: {url}")
-            
-            response = self.session.get(url, timeout=30)
-            
-            logging.info(f"📊 TMDB响应状态码: {response.status_code}")
-            if response.status_code != 200:
-                logging.error(f"❌ TMDB API请求失败: {response.status_code}")
-                logging.error(f"🔍 TMDB错误响应: {response.text[:500]}")
-                return None
-            
-            return response.json()
-                
-        except Exception as e:
-            logging.error(f"❌ 获取TMDB电影数据失败: {str(e)}")
-            return None
-    
-    def get_tv_series_info(self, tmdb_id: str) -> Optional[Dict]:
-        """获取电视剧信息"""
-        if not self.api_key:
-            logging.error("❌ TMDB API密钥未设置，无法请求TMDB API")
-            return None
-            
-        try:
-            url = f"{self.base_url}/tv/{tmdb_id}?language=zh-CN"
-            logging.info(f"🔗 TMDB API请求URL: {url}")
-            
-            response = self.session.get(url, timeout=30)
-            logging.info(f"📊 TMDB响应状态码: {response.status_code}")
-            
-            if response.status_code != 200:
-                logging.error(f"❌ TMDB API请求失败: {response.status_code}")
-                logging.error(f"🔍 TMDB错误响应: {response.text[:500]}")
-                return None
-            
-            return response.json()
-                
-        except Exception as e:
-            logging.error(f"❌ 获取TMDB电视剧数据失败: {str(e)}")
-            return None
+def location_to_country_code(location: str) -> Optional[str]:
+    """把Emby ProductionLocations中的国家名转换为国家代码（支持英文名、中文名和国家代码）"""
+    location = (location or '').strip()
+    if not location:
+        return None
+    if location.upper() in COUNTRY_DICT:
+        return location.upper()
+    for name, code in COUNTRY_NAME_DICT.items():
+        if name.lower() == location.lower():
+            return code
+    for code, name in COUNTRY_DICT.items():
+        if name == location:
+            return code
+    return None
 
 class Get_Detail:
     """国家标签抓取器主类"""
     
+    # 运行时使用的资源（主控制器据此安排并行运行）；写回时回传整个项目，不能与其他写回项目的处理器同时运行
+    RESOURCES = {EMBY_ITEMS: EXCLUSIVE, TMDB: EXCLUSIVE}
+    
     def __init__(self):
         # 从配置文件获取配置
         self.emby_server = config.get('Server', 'emby_server')
@@ -510,6 +499,21 @@ class Get_Detail:
         self.emby_user_id = config.get('Extra', 'emby_user_id', fallback=None)
         self.library_names = config.get('CountryScraper', 'library_names', fallback='').split(',')
         self.dry_run = config.getboolean('CountryScraper', 'dry_run', fallback=True)
+        # 优先使用Emby自带的ProductionLocations，缺失的字段（如语言）再查询TMDB
+        self.use_emby_locations = config.getboolean('CountryScraper', 'use_emby_locations', fallback=True)
+        # 语言信息不在缓存中时是否请求TMDB（关闭后只使用缓存中的语言信息）
+        self.fetch_languages = config.getboolean('CountryScraper', 'fetch_languages', fallback=True)
+        # 列式模式：按批把库列表和TMDB缓存装入DataFrame，向量化计算标签变更
+        self.columnar = config.getboolean('CountryScraper', 'columnar_planner', fallback=False)
+        self.source_counts = {}
+        
+        # 增量模式：只处理新增或变化的项目
+        self.scan_state = None
+        if config.getboolean('CountryScraper', 'incremental', fallback=False):
+            self.scan_state = IncrementalScanState(
+                'country_scraper',
+                full_scan_interval_days=config.getint('CountryScraper', 'full_scan_interval_days', fallback=7)
+            )
         
         # 检查TMDB API密钥
         tmdb_api_key = config.get('TMDB', 'tmdb_api_key', fallback='')
@@ -523,12 +527,14 @@ class Get_Detail:
             emby_api_key=self.emby_api_key,
             emby_user_id=self.emby_user_id
         )
-        self.tmdb_api = TMDBAPI()
-        
-        # 初始化缓存
-        self.tmdb_db = TmdbDataBase('tmdb_countries', 'country_scraper')
+        # TMDB客户端与季节重命名器共用（同一会话、同一缓存）
+        self.tmdb_api = get_tmdb_api_from_config(config)
+        # 写回缓冲区与类型映射器、季节重命名器共用（预览模式下只输出写回计划）
+        self.write_buffer = get_write_buffer_from_config(config, self.emby_api, 'CountryScraper', 'country_scraper')
         
         self.process_count = 0
+        self.item_count = 0
+        self.tmdb_count = 0
     
     def get_or_default(self, _dict, key, default=None):
         """安全获取字典值"""
@@ -536,70 +542,74 @@ class Get_Detail:
     
     def get_country_info_from_tmdb(self, tmdb_id: str, series_name: str, is_movie: bool = False):
         """从TMDB获取国家信息"""
-        cache_key = ('mv' if is_movie else 'tv') + f'{tmdb_id}'
-        cache_data = self.tmdb_db[cache_key]
-        
-        if cache_data and 'production_countries' in cache_data:
-            production_countries = cache_data["production_countries"]
-            spoken_languages = cache_data["spoken_languages"]
-            return production_countries, spoken_languages, True
-        
         try:
-            if is_movie:
-                resp_json = self.tmdb_api.get_movie_info(tmdb_id)
-            else:
-                resp_json = self.tmdb_api.get_tv_series_info(tmdb_id)
+            tmdb_data, is_cache = self.tmdb_api.get_item_info(tmdb_id, series_name, is_movie=is_movie)
+            if not tmdb_data:
+                # 否定缓存命中时 is_cache 为True，来源统计计为缓存而不是TMDB请求
+                return None, None, is_cache
             
-            if not resp_json:
-                return None, None, None
-            
-            if "production_countries" in resp_json or "spoken_languages" in resp_json:
-                production_countries = resp_json.get("production_countries", [])
-                spoken_languages = resp_json.get("spoken_languages", [])
-                
-                release_date = self.get_or_default(resp_json, 'release_date') if is_movie else self.get_or_default(
-                    resp_json, 'last_air_date', default=self.get_or_default(resp_json, 'first_air_date')
-                )
-                
-                self.tmdb_db.save_country(
-                    cache_key, 
-                    premiere_date=release_date, 
-                    name=series_name, 
-                    production_countries=production_countries, 
-                    spoken_languages=spoken_languages
-                )
-                return production_countries, spoken_languages, False
-            else:
+            production_countries = tmdb_data.get("production_countries") or []
+            spoken_languages = tmdb_data.get("spoken_languages") or []
+            if not production_countries and not spoken_languages:
                 logging.error(f"❌ TMDB中未找到国家信息: {series_name}")
                 return None, None, None
+            
+            return production_countries, spoken_languages, is_cache
                 
         except Exception as e:
             logging.error(f"❌ 获取TMDB国家数据失败: {str(e)}")
             return None, None, None
     
-    def add_country_tags(self, parent_id: str, tmdb_id: str, series_name: str, is_movie: bool = False):
-        """添加国家标签"""
+    def resolve_country_info(self, tmdb_id: str, series_name: str, is_movie: bool = False,
+                             production_locations: List[str] = None):
+        """按来源链获取国家和语言信息
+
+        1. Emby自带的ProductionLocations（本地映射，不请求TMDB）
+        2. TMDB缓存
+        3. TMDB API
+        
+        Returns:
+            tuple: (production_countries, spoken_languages, 来源)，来源如 'emby+cache'
+        """
+        if self.use_emby_locations and production_locations:
+            production_countries = [
+                {'iso_3166_1': location_to_country_code(location), 'name': location}
+                for location in production_locations
+            ]
+            
+            # Emby没有语言信息，先查缓存，再按配置决定是否请求TMDB
+            cache_data = self.tmdb_api.get_cached_info(tmdb_id, is_movie=is_movie)
+            if cache_data:
+                return production_countries, cache_data.get('spoken_languages') or [], 'emby+cache'
+            if self.fetch_languages:
+                tmdb_data, is_cache = self.tmdb_api.get_item_info(tmdb_id, series_name, is_movie=is_movie)
+                if tmdb_data:
+                    source = 'emby+cache' if is_cache else 'emby+tmdb'
+                    return production_countries, tmdb_data.get('spoken_languages') or [], source
+            return production_countries, [], 'emby'
+        
         production_countries, spoken_languages, is_cache = self.get_country_info_from_tmdb(
             tmdb_id, series_name, is_movie=is_movie
         )
-        from_cache = ' (缓存)' if is_cache else ''
+        return production_countries, spoken_languages, 'cache' if is_cache else 'tmdb'
+    
+    def add_country_tags(self, parent_id: str, tmdb_id: str, series_name: str, is_movie: bool = False,
+                         production_locations: List[str] = None, current_tags: List[str] = None,
+                         locked_fields: List[str] = None):
+        """添加国家标签"""
+        production_countries, spoken_languages, source = self.resolve_country_info(
+            tmdb_id, series_name, is_movie=is_movie, production_locations=production_locations
+        )
+        self.source_counts[source] = self.source_counts.get(source, 0) + 1
+        from_cache = ' (' + '+'.join(SOURCE_LABELS[part] for part in source.split('+')) + ')'
         
         if not production_countries and not spoken_languages:
             if not self.dry_run:
                 logging.info(f"📋 {series_name}{from_cache} 没有设置国家，跳过")
             return
         
-        # 获取项目详细信息
-        item_url = f"{self.emby_server}/emby/Users/{self.emby_user_id}/Items/{parent_id}?Fields=ChannelMappingInfo&api_key={self.emby_api_key}"
-        response = requests.get(item_url)
-        if response.status_code != 200:
-            logging.error(f"❌ 获取项目详情失败: {response.status_code}")
-            return
-        
-        item = response.json()
-        series_name = item['Name']
-        old_tags = item.get('TagItems', [])
-        old_tags = [tag['Name'] for tag in old_tags]
+        # 当前标签来自库列表（Fields=Tags），不再单独获取项目详情
+        old_tags = list(current_tags or [])
         new_tags = old_tags[:]
         
         # 处理国家标签
@@ -633,28 +643,12 @@ class Get_Detail:
         else:
             logging.info(f"🔄 {series_name}{from_cache} 设置标签为 {new_tags}")
         
-        item['Tags'] = new_tags
-        if 'TagItems' not in item:
-            item['TagItems'] = []
-        
-        for tag in new_tags:
-            if tag not in old_tags:
-                item['TagItems'].append({'Name': tag})
-        
-        if 'LockedFields' not in item:
-            item['LockedFields'] = []
-        if 'Tags' not in item['LockedFields']:
-            item['LockedFields'].append('Tags')
-        
-        if not self.dry_run:
-            update_url = f"{self.emby_server}/emby/Items/{parent_id}?api_key={self.emby_api_key}&reqformat=json"
-            update_response = requests.post(update_url, json=item)
-            
-            if update_response.status_code in [200, 204]:
-                self.process_count += 1
-                logging.info(f"✅ 成功更新 {series_name} 的标签")
-            else:
-                logging.error(f"❌ 更新失败 {series_name}: {update_response.status_code}")
+        # 登记到写回缓冲区，与其他处理器对同一项目的修改合并后一次写回
+        added_tags = [tag for tag in new_tags if tag not in old_tags]
+        self.write_buffer.add_tags(parent_id, added_tags, label=series_name, locked_fields=locked_fields,
+                                   current_tags=old_tags)
+        self.write_buffer.lock_fields(parent_id, ['Tags'], label=series_name)
+        self.process_count += 1
     
     def get_library_id(self, name: str) -> Optional[str]:
         """获取库ID"""
@@ -680,40 +674,189 @@ class Get_Detail:
             logging.error(f"❌ 获取库ID失败: {str(e)}")
             return None
     
-    def get_library_items(self, parent_id: str) -> List[Dict]:
-        """获取库中的项目（递归获取）"""
-        try:
-            params = {
-                'ParentId': parent_id,
-                'fields': 'ProviderIds'
-            }
+    def library_query(self, parent_id: str) -> Dict:
+        """库中电影和剧集的列表查询参数（按名称排序，保证分片范围稳定）"""
+        return {
+            'ParentId': parent_id,
+            'Recursive': 'true',
+            'IncludeItemTypes': 'Movie,Series',
+            'Fields': 'ProviderIds,ProductionLocations,Tags,LockedFields',
+            'SortBy': 'SortName',
+            'EnableImages': 'false',
+            'EnableUserData': 'false'
+        }
+    
+    def get_library_items(self, parent_id: str, start_index: int = 0, max_items: int = None) -> Iterator[Dict]:
+        """流式获取库中的电影和剧集（分页拉取，逐页处理后释放，内存占用与库大小无关）"""
+        return self.emby_api.iter_items(self.library_query(parent_id), start_index=start_index, max_items=max_items)
+    
+    def process_library(self, library_id: str, items: Iterable[Dict]):
+        """逐个处理库中的项目，计数随处理累加"""
+        total_count = 0
+        tmdb_count = 0
+        batch = []
+        for item in items:
+            total_count += 1
+            if self.scan_state:
+                self.scan_state.record_item(library_id, item)
             
-            response = requests.get(
-                f"{self.emby_server}/emby/Items",
-                headers={'X-Emby-Token': self.emby_api_key},
-                params=params
-            )
+            # 调试：打印ProviderIds信息
+            provider_ids = item.get('ProviderIds', {})
+            logging.debug(f"🔍 项目 {item['Name']} 的ProviderIds: {provider_ids}")
             
-            if response.status_code != 200:
-                logging.error(f"❌ 获取库项目失败: {response.status_code}")
-                return []
+            tmdb_id = provider_ids.get('Tmdb')
+            if not tmdb_id:
+                logging.debug(f"⏭️ 跳过项目 {item['Name']}: 没有TMDB ID")
+                continue
+            tmdb_count += 1
             
-            items = response.json().get('Items', [])
+            item_name = item['Name']
+            item_id = item['Id']
+            is_movie = item['Type'] == 'Movie'
             
-            # 分离文件夹和普通项目
-            items_folder = [item for item in items if item["Type"] == "Folder"]
-            items_normal = [item for item in items if item["Type"] != "Folder"]
+            # 只处理电影和电视剧
+            if item['Type'] not in ['Movie', 'Series']:
+                logging.debug(f"⏭️ 跳过非电影/电视剧项目: {item_name} (类型: {item['Type']})")
+                continue
             
-            # 递归获取文件夹中的项目
-            for folder in items_folder:
-                folder_items = self.get_library_items(folder['Id'])
-                items_normal.extend(folder_items)
+            # 列式模式：攒够一批后整体规划
+            if self.columnar:
+                batch.append(item)
+                if len(batch) >= COLUMNAR_BATCH_SIZE:
+                    self.plan_columnar(batch)
+                    batch = []
+                continue
             
-            return items_normal
-                
-        except Exception as e:
-            logging.error(f"❌ 获取库项目异常: {str(e)}")
+            logging.info(f"🎬 处理项目: {item_name} (TMDB: {tmdb_id})")
+            self.add_country_tags(item_id, tmdb_id, item_name, is_movie,
+                                  production_locations=item.get('ProductionLocations'),
+                                  current_tags=[tag['Name'] for tag in item.get('TagItems', [])],
+                                  locked_fields=item.get('LockedFields', []))
+        
+        if batch:
+            self.plan_columnar(batch)
+        
+        self.item_count += total_count
+        self.tmdb_count += tmdb_count
+        logging.info(f"📋 找到 {total_count} 个项目，其中 {tmdb_count} 个项目有TMDB ID")
+    
+    def resolve_cached_country_info(self, item: Dict, is_movie: bool):
+        """列式模式：只用Emby制片国家和TMDB缓存获取国家/语言代码
+        
+        Returns:
+            tuple: (国家代码列表, 语言代码列表, 来源)；需要请求TMDB时返回None，由逐项目流程处理
+        """
+        tmdb_id = item['ProviderIds']['Tmdb']
+        cache_data = self.tmdb_api.get_cache_entry(tmdb_id, is_movie=is_movie)
+        positive = cache_data if cache_data and not cache_data.get('not_found') else None
+        
+        production_locations = item.get('ProductionLocations')
+        if self.use_emby_locations and production_locations:
+            countries = [location_to_country_code(location) for location in production_locations]
+            if positive:
+                return countries, [lang['iso_639_1'] for lang in positive.get('spoken_languages') or []], 'emby+cache'
+            if self.fetch_languages and not cache_data:
+                return None
+            return countries, [], 'emby'
+        
+        if not cache_data:
+            return None
+        if not positive:
+            return [], [], 'cache'
+        return ([country['iso_3166_1'] for country in positive.get('production_countries') or []],
+                [lang['iso_639_1'] for lang in positive.get('spoken_languages') or []],
+                'cache')
+    
+    def plan_columnar(self, items: List[Dict]):
+        """列式模式：一批项目装入DataFrame，向量化计算标签变更，需要请求TMDB的项目回退到逐项目流程"""
+        records = []
+        fallback = []
+        items_by_id = {}
+        for item in items:
+            is_movie = item['Type'] == 'Movie'
+            resolved = self.resolve_cached_country_info(item, is_movie)
+            if resolved is None:
+                fallback.append(item)
+                continue
+            country_codes, language_codes, source = resolved
+            self.source_counts[source] = self.source_counts.get(source, 0) + 1
+            items_by_id[item['Id']] = item
+            records.append({
+                'item_id': item['Id'],
+                'tags': [tag['Name'] for tag in item.get('TagItems', [])],
+                'country_codes': country_codes,
+                'language_codes': language_codes
+            })
+        
+        frame = pd.DataFrame.from_records(records, columns=['item_id', 'tags', 'country_codes', 'language_codes'])
+        additions = plan_tag_additions(frame, COUNTRY_DICT, LANGUAGE_DICT, DEFAULT_COUNTRY, DEFAULT_LANGUAGE)
+        logging.info(f"🧮 列式规划: {len(records)} 个项目中 {len(additions)} 个需要更新标签，"
+                     f"{len(fallback)} 个需要请求TMDB")
+        
+        for item_id, added_tags in additions.items():
+            item = items_by_id[item_id]
+            old_tags = [tag['Name'] for tag in item.get('TagItems', [])]
+            logging.info(f"🔄 {item['Name']} 添加标签 {added_tags}")
+            self.write_buffer.add_tags(item_id, added_tags, label=item['Name'],
+                                       locked_fields=item.get('LockedFields', []), current_tags=old_tags)
+            self.write_buffer.lock_fields(item_id, ['Tags'], label=item['Name'])
+            self.process_count += 1
+        
+        for item in fallback:
+            logging.info(f"🎬 处理项目: {item['Name']} (TMDB: {item['ProviderIds']['Tmdb']})")
+            self.add_country_tags(item['Id'], item['ProviderIds']['Tmdb'], item['Name'], item['Type'] == 'Movie',
+                                  production_locations=item.get('ProductionLocations'),
+                                  current_tags=[tag['Name'] for tag in item.get('TagItems', [])],
+                                  locked_fields=item.get('LockedFields', []))
+    
+    def stats(self) -> Dict:
+        """运行统计（分片执行时由主控制器汇总）"""
+        return {
+            'items': self.item_count,
+            'with_tmdb': self.tmdb_count,
+            'processed': self.process_count,
+            'sources': dict(self.source_counts)
+        }
+    
+    def plan_shards(self, workers: int, min_shard_size: int) -> List[Dict]:
+        """分片执行：按 StartIndex 范围拆分各库；增量模式下不分片，返回空列表"""
+        if self.scan_state or not self.library_names or not self.library_names[0]:
             return []
+        
+        # 缓存淘汰在父进程中执行一次，各分片进程沿用同步结果直接使用缓存
+        if config.getboolean('TMDB', 'use_changes_api', fallback=False):
+            self.tmdb_api.sync_changes()
+        tracking_since = self.tmdb_api.tracking_since()
+        
+        shards = []
+        for library_name in self.library_names:
+            library_name = library_name.strip()
+            library_id = self.get_library_id(library_name)
+            if not library_id:
+                continue
+            total = self.emby_api.count_items(self.library_query(library_id)) or 0
+            for start_index, limit in split_shards(total, workers, min_shard_size):
+                shards.append({
+                    'index': len(shards),
+                    'library_name': library_name,
+                    'library_id': library_id,
+                    'start_index': start_index,
+                    'limit': limit,
+                    'tmdb_tracking_since': tracking_since
+                })
+        return shards
+    
+    def run_shard(self, shard: Dict) -> Dict:
+        """处理一个分片（在子进程中运行），返回统计"""
+        logging.info(f"📚 处理库分片: {shard['library_name']} "
+                     f"[{shard['start_index']}, {shard['start_index'] + shard['limit']})")
+        items = self.get_library_items(shard['library_id'], shard['start_index'], shard['limit'])
+        self.process_library(shard['library_id'], items)
+        
+        if self.write_buffer.dry_run:
+            self.write_buffer.plan_name = f"{self.write_buffer.plan_name}_shard{shard['index']}"
+        self.write_buffer.flush_if_idle()
+        return self.stats()
     
     def run(self):
         """运行抓取器"""
@@ -721,7 +864,11 @@ class Get_Detail:
         
         if not self.library_names or not self.library_names[0]:
             logging.error("❌ 未配置库名称")
-            return
+            return self.stats()
+        
+        # 根据TMDB变更列表淘汰缓存，未变更的条目可长期使用
+        if config.getboolean('TMDB', 'use_changes_api', fallback=False):
+            self.tmdb_api.sync_changes()
         
         for library_name in self.library_names:
             library_name = library_name.strip()
@@ -736,38 +883,28 @@ class Get_Detail:
                 continue
             
             # 获取库中的项目
-            items = self.get_library_items(library_id)
-            logging.info(f"📋 找到 {len(items)} 个项目")
-            
-            # 统计有TMDB ID的项目
-            items_with_tmdb = [item for item in items if item.get('ProviderIds', {}).get('Tmdb')]
-            logging.info(f"🎯 其中 {len(items_with_tmdb)} 个项目有TMDB ID")
+            if self.scan_state:
+                items = self.scan_state.collect_items(
+                    self.emby_api, library_id, 'Movie,Series', fields=f'{FINGERPRINT_FIELDS},ProductionLocations,LockedFields'
+                )
+            else:
+                items = self.get_library_items(library_id)
             
-            for item in items:
-                # 调试：打印ProviderIds信息
-                provider_ids = item.get('ProviderIds', {})
-                logging.debug(f"🔍 项目 {item['Name']} 的ProviderIds: {provider_ids}")
-                
-                tmdb_id = provider_ids.get('Tmdb')
-                if not tmdb_id:
-                    logging.debug(f"⏭️ 跳过项目 {item['Name']}: 没有TMDB ID")
-                    continue
-                
-                item_name = item['Name']
-                item_id = item['Id']
-                is_movie = item['Type'] == 'Movie'
-                
-                # 只处理电影和电视剧
-                if item['Type'] not in ['Movie', 'Series']:
-                    logging.debug(f"⏭️ 跳过非电影/电视剧项目: {item_name} (类型: {item['Type']})")
-                    continue
-                
-                logging.info(f"🎬 处理项目: {item_name} (TMDB: {tmdb_id})")
-                self.add_country_tags(item_id, tmdb_id, item_name, is_movie)
+            # 边拉取边处理
+            self.process_library(library_id, items)
+            if self.scan_state:
+                self.scan_state.finish(library_id)
         
+        if self.source_counts:
+            logging.info(f"📊 国家/语言信息来源统计: {self.source_counts}")
+        # 写回完成后再保存增量状态（写回被主控制器暂缓时在整批写回后保存），预览模式下不保存
+        if self.scan_state and not self.write_buffer.dry_run:
+            self.write_buffer.after_flush(self.scan_state.commit)
+        self.write_buffer.flush_if_idle()
         logging.info(f"✅ 国家标签抓取器运行完成，处理了 {self.process_count} 个项目")
+        return self.stats()
 
 if __name__ == "__main__":
     logging.info("执行单次任务")
     gd = Get_Detail()
-    gd.run() 
\ No newline at end of file
+    gd.run()
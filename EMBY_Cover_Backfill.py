@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Emby 合集封面补全器
+用合集内子项目的海报和背景图补全缺图的合集（如【钢铁侠系列】没有封面时，使用钢铁侠1的海报和背景图）
+"""
+import os
+import time
+import logging
+from typing import List, Dict, Optional
+from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor
+from utils import EmbyAPI, item_image_tag
+from image_transfer import get_image_transfer_from_config
+from image_cache import get_image_cache_from_config, get_cover_sources_from_config
+from resources import EMBY_IMAGES, EXCLUSIVE
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('emby_importer.log'),
+        logging.StreamHandler()
+    ]
+)
+
+# 加载配置
+config = ConfigParser()
+with open('config.conf', encoding='utf-8') as f:
+    config.read_file(f)
+
+# 配置代理
+use_proxy = config.getboolean('Proxy', 'use_proxy', fallback=False)
+if use_proxy:
+    os.environ['http_proxy'] = config.get('Proxy', 'http_proxy', fallback='http://127.0.0.1:7890')
+    os.environ['https_proxy'] = config.get('Proxy', 'https_proxy', fallback='http://127.0.0.1:7890')
+else:
+    os.environ.pop('http_proxy', None)
+    os.environ.pop('https_proxy', None)
+
+class Get_Detail:
+    """合集封面补全器主类"""
+
+    # 运行时使用的资源（主控制器据此安排并行运行）
+    RESOURCES = {EMBY_IMAGES: EXCLUSIVE}
+
+    def __init__(self):
+        # 从配置文件获取配置
+        self.emby_server = config.get('Server', 'emby_server')
+        self.emby_api_key = config.get('Server', 'emby_api_key')
+        self.library_name = config.get('CoverBackfill', 'library_name', fallback='合集').strip()
+        self.image_types = [t.strip() for t in config.get('CoverBackfill', 'image_types', fallback='Primary,Backdrop').split(',') if t.strip()]
+        self.max_concurrency = max(1, config.getint('CoverBackfill', 'max_concurrency', fallback=4))
+        self.dry_run = config.getboolean('CoverBackfill', 'dry_run', fallback=False)
+
+        # 初始化API客户端（下载和上传共用同一会话与请求节流）
+        self.emby_api = EmbyAPI(
+            emby_server=self.emby_server,
+            emby_api_key=self.emby_api_key
+        )
+        self.emby_api.set_image_transfer(get_image_transfer_from_config(config))
+        # 同一张子项目海报（图片标签不变）只下载一次
+        self.emby_api.set_image_cache(get_image_cache_from_config(config))
+        self.emby_api.set_cover_sources(get_cover_sources_from_config(config))
+
+        self.collection_count = 0
+        self.missing_count = 0
+        self.filled_count = 0
+        self.previewed_count = 0
+        self.unfilled = {}
+        self.timings = {}
+
+    def get_library_id(self, name: str) -> Optional[str]:
+        """获取合集库ID"""
+        params = {
+            'IncludeItemTypes': 'CollectionFolder',
+            'Recursive': 'true',
+            'SearchTerm': name
+        }
+        for item in self.emby_api.iter_items(params):
+            if item['Name'] == name:
+                logging.info(f"📚 找到合集库 '{name}'，ID: {item['Id']}")
+                return item['Id']
+        logging.error(f"❌ 找不到合集库: {name}")
+        return None
+
+    def get_collections_missing_images(self, library_id: str) -> List[tuple]:
+        """分页列出合集库一次，根据列表自带的 ImageTags / BackdropImageTags 找出缺图的合集
+
+        返回 [(合集, [缺失的图片类型, ...]), ...]
+        """
+        params = {
+            'ParentId': library_id,
+            'Recursive': 'true',
+            'SortBy': 'SortName',
+            'EnableUserData': 'false'
+        }
+        worklist = []
+        for collection in self.emby_api.iter_items(params, page_size=200):
+            self.collection_count += 1
+            missing = [t for t in self.image_types if item_image_tag(collection, t) is None]
+            if missing:
+                worklist.append((collection, missing))
+
+        for image_type in self.image_types:
+            count = sum(1 for _, missing in worklist if image_type in missing)
+            logging.info(f"🔍 {count} 个合集缺少 {image_type}（共 {self.collection_count} 个合集）")
+        return worklist
+
+    def get_children(self, parent_id: str) -> List[Dict]:
+        """获取合集的子项目（列表中自带图片标签，无需逐个探测图片）"""
+        params = {
+            'ParentId': parent_id,
+            'Recursive': 'true',
+            'SortBy': 'SortName',
+            'EnableUserData': 'false'
+        }
+        return list(self.emby_api.iter_items(params))
+
+    def fill_collection(self, collection: Dict, missing: List[str]) -> tuple:
+        """用子项目的图片补全一个合集缺失的图片（子项目只获取一次）
+
+        返回 (未能补全的图片类型列表, 是否只是预览)
+        """
+        collection_id = collection['Id']
+        collection_name = collection.get('Name', collection_id)
+        children = self.get_children(collection_id)
+        unfilled = []
+        previewed = False
+        for image_type in missing:
+            # 合集当前缺少该图片，之前的来源记录已失效
+            if self.emby_api.cover_sources:
+                self.emby_api.cover_sources.forget(collection_id, image_type)
+            child = next((child for child in children if item_image_tag(child, image_type) is not None), None)
+            if not child:
+                logging.warning(f"⚠️ 合集 {collection_name} 的子项目均无 {image_type} 图片")
+                unfilled.append(image_type)
+                continue
+
+            if self.dry_run:
+                logging.info(f"🔍 [预览] 合集 {collection_name} 的 {image_type} 将使用 {child.get('Name')} 的图片")
+                previewed = True
+                continue
+
+            if self.emby_api.copy_item_image(child['Id'], collection_id, image_type,
+                                             image_tag=item_image_tag(child, image_type)):
+                logging.info(f"✅ 已补全合集 {collection_name} 的 {image_type} 图片")
+            else:
+                unfilled.append(image_type)
+        return unfilled, previewed
+
+    def stats(self) -> Dict:
+        """运行统计（由主控制器记录到运行结果中）"""
+        return {
+            'collections': self.collection_count,
+            'missing': self.missing_count,
+            'filled': self.filled_count,
+            'previewed': self.previewed_count,
+            'unfilled': len(self.unfilled),
+            'timings': dict(self.timings)
+        }
+
+    def run(self):
+        """运行封面补全器"""
+        logging.info("🚀 开始运行合集封面补全器")
+
+        start_time = time.time()
+        library_id = self.get_library_id(self.library_name)
+        if not library_id:
+            return self.stats()
+
+        worklist = self.get_collections_missing_images(library_id)
+        self.missing_count = len(worklist)
+        list_time = time.time()
+        self.timings['list_seconds'] = round(list_time - start_time, 2)
+
+        # 各合集相互独立，有限并发补全（请求速率由共用的Emby客户端控制）
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            results = executor.map(lambda entry: (entry[0], *self.fill_collection(*entry)), worklist)
+            for collection, unfilled, previewed in results:
+                if unfilled:
+                    self.unfilled[collection.get('Name', collection['Id'])] = unfilled
+                elif previewed:
+                    # 预览模式没有实际上传，单独计数
+                    self.previewed_count += 1
+                else:
+                    self.filled_count += 1
+        self.timings['fill_seconds'] = round(time.time() - list_time, 2)
+
+        if self.unfilled:
+            logging.warning(f"⚠️ {len(self.unfilled)} 个合集未能补全: {self.unfilled}")
+        if self.dry_run:
+            logging.info(f"🔍 [预览] 合集封面补全器运行完成，{self.previewed_count}/{self.missing_count} 个缺图合集可以补全")
+        else:
+            logging.info(f"✅ 合集封面补全器运行完成，补全了 {self.filled_count}/{self.missing_count} 个缺图合集")
+        return self.stats()
+
+if __name__ == "__main__":
+    logging.info("执行单次任务")
+    gd = Get_Detail()
+    gd.run()
@@ -7,8 +7,14 @@ Emby 类型标签映射器 - 重构版本
 """
 import os
 import logging
+import pandas as pd
 from configparser import ConfigParser
 from utils import EmbyAPI
+from scan_state import IncrementalScanState
+from writeback_buffer import get_write_buffer_from_config
+from sharding import split_shards
+from columnar_planner import plan_genre_maps, COLUMNAR_BATCH_SIZE
+from resources import EMBY_ITEMS, EXCLUSIVE
 
 # 配置日志
 logging.basicConfig(
@@ -37,6 +43,9 @@ else:
 class Get_Detail:
     """类型标签映射器主类"""
     
+    # 运行时使用的资源（主控制器据此安排并行运行）；写回时回传整个项目，不能与其他写回项目的处理器同时运行
+    RESOURCES = {EMBY_ITEMS: EXCLUSIVE}
+    
     def __init__(self):
         # 从配置文件获取配置
         self.emby_server = config.get('Server', 'emby_server')
@@ -45,6 +54,20 @@ class Get_Detail:
         self.library_names = config.get('GenreMapper', 'library_names', fallback='').split(',')
         self.dry_run = config.getboolean('GenreMapper', 'dry_run', fallback=True)
         
+        # 定向模式：先查询库中的类型列表，只列出带有待映射类型的项目
+        self.targeted = config.getboolean('GenreMapper', 'targeted', fallback=True)
+        
+        # 列式模式：按批把库列表装入DataFrame，向量化计算类型映射
+        self.columnar = config.getboolean('GenreMapper', 'columnar_planner', fallback=False)
+        
+        # 增量模式：只处理新增或变化的项目
+        self.scan_state = None
+        if config.getboolean('GenreMapper', 'incremental', fallback=False):
+            self.scan_state = IncrementalScanState(
+                'genre_mapper',
+                full_scan_interval_days=config.getint('GenreMapper', 'full_scan_interval_days', fallback=7)
+            )
+        
         # 从配置文件读取类型映射（中文->英文）
         self.genre_mapping = {}
         if config.has_section('GenreMapping'):
@@ -64,8 +87,12 @@ class Get_Detail:
             emby_api_key=self.emby_api_key,
             emby_user_id=self.emby_user_id
         )
+        # 写回缓冲区与国家标签抓取器、季节重命名器共用（预览模式下只输出写回计划）
+        self.write_buffer = get_write_buffer_from_config(config, self.emby_api, 'GenreMapper', 'genre_mapper')
         
         self.process_count = 0
+        self.item_count = 0
+        self.media_count = 0
     
     def get_library_id(self, library_name):
         """获取库ID"""
@@ -73,7 +100,9 @@ class Get_Detail:
             return None
         
         try:
-            response = self.emby_api._make_request('GET', '/Library/VirtualFolders')
+            response = self.emby_api._make_request(
+                'GET', f"{self.emby_server}/emby/Library/VirtualFolders?api_key={self.emby_api_key}"
+            )
             if response and response.status_code == 200:
                 libraries = response.json()
                 for lib in libraries:
@@ -86,105 +115,172 @@ class Get_Detail:
             logging.error(f"❌ 获取库ID失败: {str(e)}")
             return None
     
-    def get_library_items(self, parent_id):
-        """递归获取库中的所有项目"""
-        try:
-            params = {
-                'ParentId': parent_id,
-                'fields': 'ProviderIds'
-            }
-            response = self.emby_api._make_request('GET', '/Items', params=params)
-            if not response or response.status_code != 200:
-                return []
-            
-            data = response.json()
-            items = data.get('Items', [])
-            
-            # 分离文件夹和普通项目
-            folders = [item for item in items if item['Type'] == 'Folder']
-            normal_items = [item for item in items if item['Type'] != 'Folder']
-            
-            # 递归处理文件夹
-            for folder in folders:
-                sub_items = self.get_library_items(folder['Id'])
-                normal_items.extend(sub_items)
-            
-            return normal_items
-        except Exception as e:
-            logging.error(f"❌ 获取库项目失败: {str(e)}")
+    def library_query(self, parent_id):
+        """库中电影和剧集的列表查询参数（按名称排序，保证分片范围稳定）"""
+        return {
+            'ParentId': parent_id,
+            'Recursive': 'true',
+            'IncludeItemTypes': 'Movie,Series',
+            'Fields': 'ProviderIds,Genres',
+            'SortBy': 'SortName',
+            'EnableImages': 'false',
+            'EnableUserData': 'false'
+        }
+    
+    def get_library_items(self, parent_id, start_index=0, max_items=None):
+        """流式获取库中的电影和剧集（分页拉取，逐页处理后释放，内存占用与库大小无关）"""
+        return self.emby_api.iter_items(self.library_query(parent_id), start_index=start_index, max_items=max_items)
+    
+    def get_targeted_items(self, library_id):
+        """定向模式：只获取带有待映射类型的项目
+        
+        先通过 /Genres 获取库中出现过的类型，与映射规则取交集，
+        再按这些类型过滤项目；库中没有待映射类型时直接返回空列表
+        """
+        genres = self.emby_api.get_genres(library_id, 'Movie,Series')
+        if genres is None:
+            return None
+        
+        mapped_genres = [genre for genre in genres if genre in self.reverse_genre_mapping]
+        if not mapped_genres:
+            logging.info(f"⏭️ 库中 {len(genres)} 个类型均无需映射，跳过")
             return []
+        
+        logging.info(f"🎯 库中待映射的类型: {mapped_genres}")
+        return self.emby_api.iter_items({
+            'ParentId': library_id,
+            'Recursive': 'true',
+            'IncludeItemTypes': 'Movie,Series',
+            'Genres': '|'.join(mapped_genres),
+            'Fields': 'Genres',
+            'EnableImages': 'false',
+            'EnableUserData': 'false'
+        })
     
-    def update_item_genres(self, item_id, item_name):
-        """更新项目的类型标签"""
-        try:
-            # 获取项目详情
-            response = self.emby_api._make_request('GET', f'/Users/{self.emby_user_id}/Items/{item_id}?Fields=ChannelMappingInfo')
-            if not response or response.status_code != 200:
-                logging.error(f"❌ 获取项目详情失败: {item_name}")
-                return False
-            
-            item_data = response.json()
-            original_genres = item_data.get('Genres', [])
-            original_genre_items = item_data.get('GenreItems', [])
+    def update_item_genres(self, item_id, item_name, original_genres):
+        """登记项目的类型映射（类型来自库列表，实际写回由写回缓冲区合并完成）"""
+        genre_map = {}
+        new_genres = []
+        for genre in original_genres:
+            if genre in self.reverse_genre_mapping:
+                new_genre = self.reverse_genre_mapping[genre]
+                genre_map[genre] = new_genre
+                new_genres.append(new_genre)
+                logging.info(f"🔄 类型映射: {genre} -> {new_genre}")
+            else:
+                new_genres.append(genre)
+        
+        if not genre_map:
+            logging.debug(f"⏭️ 无需更新: {item_name}")
+            return False
+        
+        logging.info(f"📝 {item_name}:")
+        logging.info(f"   原类型: {original_genres}")
+        logging.info(f"   新类型: {new_genres}")
+        
+        if self.dry_run:
+            logging.info(f"🔍 预览模式 - 将更新: {item_name}")
+        self.write_buffer.map_genres(item_id, genre_map, label=item_name, current_genres=original_genres)
+        self.process_count += 1
+        return True
+    
+    def process_library(self, library_id, items, scan_state=None):
+        """逐个处理库中的项目，计数随处理累加"""
+        total_count = 0
+        media_count = 0
+        batch = []
+        for item in items:
+            total_count += 1
+            # 只处理电影和剧集
+            if item['Type'] not in ['Movie', 'Series']:
+                continue
+            media_count += 1
             
-            # 检查是否需要更新
-            need_update = False
-            new_genres = []
-            new_genre_items = []
+            item_id = item['Id']
+            item_name = item.get('Name', 'Unknown')
+            item_type = item['Type']
             
-            # 处理Genres
-            for genre in original_genres:
-                if genre in self.reverse_genre_mapping:
-                    new_genre = self.reverse_genre_mapping[genre]
-                    new_genres.append(new_genre)
-                    need_update = True
-                    logging.info(f"🔄 类型映射: {genre} -> {new_genre}")
-                else:
-                    new_genres.append(genre)
+            if scan_state:
+                scan_state.record_item(library_id, item)
             
-            # 处理GenreItems
-            for genre_item in original_genre_items:
-                genre_name = genre_item.get('Name', '')
-                if genre_name in self.reverse_genre_mapping:
-                    new_genre_name = self.reverse_genre_mapping[genre_name]
-                    new_genre_item = genre_item.copy()
-                    new_genre_item['Name'] = new_genre_name
-                    new_genre_items.append(new_genre_item)
-                    need_update = True
-                else:
-                    new_genre_items.append(genre_item)
+            # 列式模式：攒够一批后整体规划
+            if self.columnar:
+                batch.append(item)
+                if len(batch) >= COLUMNAR_BATCH_SIZE:
+                    self.plan_columnar(batch)
+                    batch = []
+                continue
             
-            if need_update:
-                logging.info(f"📝 {item_name}:")
-                logging.info(f"   原类型: {original_genres}")
-                logging.info(f"   新类型: {new_genres}")
-                
-                # 更新数据
-                item_data['Genres'] = new_genres
-                item_data['GenreItems'] = new_genre_items
-                
-                if not self.dry_run:
-                    # 实际更新
-                    update_response = self.emby_api._make_request('POST', f'/Items/{item_id}?reqformat=json', json_data=item_data)
-                    if update_response and update_response.status_code in [200, 204]:
-                        self.process_count += 1
-                        logging.info(f"✅ 成功更新: {item_name}")
-                        return True
-                    else:
-                        logging.error(f"❌ 更新失败: {item_name} - {update_response.status_code if update_response else 'No response'}")
-                        return False
-                else:
-                    # 预览模式
-                    logging.info(f"🔍 预览模式 - 将更新: {item_name}")
-                    self.process_count += 1
-                    return True
-            else:
-                logging.debug(f"⏭️ 无需更新: {item_name}")
-                return True
-                
-        except Exception as e:
-            logging.error(f"❌ 更新项目类型失败 {item_name}: {str(e)}")
-            return False
+            logging.debug(f"🔍 处理项目: {item_name} ({item_type})")
+            self.update_item_genres(item_id, item_name, item.get('Genres', []))
+        
+        if batch:
+            self.plan_columnar(batch)
+        
+        self.item_count += total_count
+        self.media_count += media_count
+        logging.info(f"📦 共有 {total_count} 个项目，其中媒体项目 {media_count} 个")
+    
+    def plan_columnar(self, items):
+        """列式模式：一批项目装入DataFrame，向量化计算类型映射"""
+        frame = pd.DataFrame.from_records(
+            [{'item_id': item['Id'], 'genres': item.get('Genres', [])} for item in items],
+            columns=['item_id', 'genres']
+        )
+        genre_maps = plan_genre_maps(frame, self.reverse_genre_mapping)
+        logging.info(f"🧮 列式规划: {len(items)} 个项目中 {len(genre_maps)} 个需要映射类型")
+        
+        items_by_id = {item['Id']: item for item in items}
+        for item_id, genre_map in genre_maps.items():
+            item = items_by_id[item_id]
+            item_name = item.get('Name', 'Unknown')
+            logging.info(f"🔄 {item_name} 类型映射: {genre_map}")
+            self.write_buffer.map_genres(item_id, genre_map, label=item_name, current_genres=item.get('Genres', []))
+            self.process_count += 1
+    
+    def stats(self):
+        """运行统计（分片执行时由主控制器汇总）"""
+        return {
+            'items': self.item_count,
+            'media_items': self.media_count,
+            'processed': self.process_count
+        }
+    
+    def plan_shards(self, workers, min_shard_size):
+        """分片执行：按 StartIndex 范围拆分各库；定向模式和增量模式下不分片，返回空列表"""
+        if self.targeted or self.scan_state or not self.reverse_genre_mapping:
+            return []
+        if not self.library_names or not self.library_names[0].strip():
+            return []
+        
+        shards = []
+        for library_name in self.library_names:
+            library_name = library_name.strip()
+            library_id = self.get_library_id(library_name)
+            if not library_id:
+                continue
+            total = self.emby_api.count_items(self.library_query(library_id)) or 0
+            for start_index, limit in split_shards(total, workers, min_shard_size):
+                shards.append({
+                    'index': len(shards),
+                    'library_name': library_name,
+                    'library_id': library_id,
+                    'start_index': start_index,
+                    'limit': limit
+                })
+        return shards
+    
+    def run_shard(self, shard):
+        """处理一个分片（在子进程中运行），返回统计"""
+        logging.info(f"📚 处理库分片: {shard['library_name']} "
+                     f"[{shard['start_index']}, {shard['start_index'] + shard['limit']})")
+        items = self.get_library_items(shard['library_id'], shard['start_index'], shard['limit'])
+        self.process_library(shard['library_id'], items)
+        
+        if self.write_buffer.dry_run:
+            self.write_buffer.plan_name = f"{self.write_buffer.plan_name}_shard{shard['index']}"
+        self.write_buffer.flush_if_idle()
+        return self.stats()
     
     def run(self):
         """运行类型标签映射器"""
@@ -192,11 +288,11 @@ class Get_Detail:
         
         if not self.library_names or not self.library_names[0].strip():
             logging.error("❌ 未配置库名称，请在config.conf中设置[GenreMapper]library_names")
-            return
+            return self.stats()
         
         if not self.reverse_genre_mapping:
             logging.warning("⚠️ 没有配置类型映射规则，跳过处理")
-            return
+            return self.stats()
         
         logging.info(f"📋 类型映射规则: {self.reverse_genre_mapping}")
         logging.info(f"🔍 预览模式: {'是' if self.dry_run else '否'}")
@@ -214,25 +310,28 @@ class Get_Detail:
             if not library_id:
                 continue
             
-            # 获取库中的所有项目
-            items = self.get_library_items(library_id)
-            logging.info(f"📦 库 {library_name} 中共有 {len(items)} 个项目")
-            
-            # 只处理电影和剧集
-            media_items = [item for item in items if item['Type'] in ['Movie', 'Series']]
-            logging.info(f"🎬 媒体项目数量: {len(media_items)}")
+            # 获取库中的项目：定向模式优先，其次增量模式，最后全量
+            scan_state = None
+            items = self.get_targeted_items(library_id) if self.targeted else None
+            if items is None:
+                if self.scan_state:
+                    scan_state = self.scan_state
+                    items = scan_state.collect_items(self.emby_api, library_id, 'Movie,Series')
+                else:
+                    items = self.get_library_items(library_id)
             
-            # 处理每个项目
-            for item in media_items:
-                item_id = item['Id']
-                item_name = item.get('Name', 'Unknown')
-                item_type = item['Type']
-                
-                logging.debug(f"🔍 处理项目: {item_name} ({item_type})")
-                self.update_item_genres(item_id, item_name)
+            # 边拉取边处理
+            self.process_library(library_id, items, scan_state=scan_state)
+            if scan_state:
+                scan_state.finish(library_id)
         
+        # 写回完成后再保存增量状态（写回被主控制器暂缓时在整批写回后保存），预览模式下不保存
+        if self.scan_state and not self.write_buffer.dry_run:
+            self.write_buffer.after_flush(self.scan_state.commit)
+        self.write_buffer.flush_if_idle()
         logging.info(f"🎯 类型标签映射完成，共处理 {self.process_count} 个项目")
         logging.info("✅ 类型标签映射器运行完成")
+        return self.stats()
 
 if __name__ == "__main__":
     logging.info("执行单次任务")
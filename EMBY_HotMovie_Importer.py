@@ -10,7 +10,10 @@ import logging
 from typing import List
 from datetime import datetime
 from configparser import ConfigParser
-from utils import EmbyAPI, RSSHubAPI
+from utils import EmbyAPI, RSSHubAPI, item_image_tag
+from image_transfer import get_image_transfer_from_config
+from image_cache import get_image_cache_from_config, get_cover_sources_from_config
+from resources import RSSHUB, EMBY_COLLECTIONS, EMBY_IMAGES, SHARED
 
 # 配置日志
 logging.basicConfig(
@@ -52,6 +55,9 @@ class DbMovieRss:
 class Get_Detail:
     """热门电影导入器主类"""
     
+    # 运行时使用的资源（主控制器据此安排并行运行）
+    RESOURCES = {RSSHUB: SHARED, EMBY_COLLECTIONS: SHARED, EMBY_IMAGES: SHARED}
+    
     def __init__(self):
         self.noexist = []
         self.dbmovies = {}
@@ -87,6 +93,10 @@ class Get_Detail:
             emby_api_key=self.emby_api_key,
             emby_user_id=self.emby_user_id
         )
+        # 封面传输选项（服务端缩放、可选重新压缩）
+        self.emby_api.set_image_transfer(get_image_transfer_from_config(config))
+        self.emby_api.set_image_cache(get_image_cache_from_config(config))
+        self.emby_api.set_cover_sources(get_cover_sources_from_config(config))
         self.rss_api = RSSHubAPI(rsshub_server=self.rsshub_server, name_mapping=self.name_mapping)
     
 
@@ -134,10 +144,11 @@ class Get_Detail:
         collection = self.emby_api.check_collection_exists(collection_name)
         if collection:
             # 获取合集中的电影列表
-            items = self.emby_api.get_collection_items(collection['Id'])
+            members = self.get_collection_members(collection['Id'])
             return {
                 'box_id': collection['Id'],
-                'box_movies': items
+                'box_movies': [member.get('Name', '') for member in members],
+                'box_members': members
             }
         return None
     
@@ -149,9 +160,24 @@ class Get_Detail:
         """清空合集"""
         return self.emby_api.clear_collection(collection_id)
     
-    def replace_cover_image(self, box_id, image_url):
-        """替换合集封面"""
-        return self.emby_api.replace_collection_cover(box_id, image_url)
+    def replace_cover_image(self, box_id, source_item):
+        """用作品的海报替换合集封面（经过本地图片缓存）"""
+        return self.emby_api.copy_item_image(source_item['Id'], box_id, 'Primary',
+                                             image_tag=item_image_tag(source_item, 'Primary'))
+    
+    def get_collection_members(self, box_id):
+        """获取合集成员（列表自带海报的图片标签）"""
+        params = {'ParentId': box_id, 'EnableUserData': 'false'}
+        return list(self.emby_api.iter_items(params))
+    
+    def get_cover_member(self, members):
+        """按RSS顺序找到已在合集中且有海报的首部作品（直接使用合集成员列表，不再逐部搜索）"""
+        members_by_name = {}
+        for member in members:
+            if item_image_tag(member, 'Primary'):
+                members_by_name.setdefault(member.get('Name', ''), member)
+        return next((members_by_name[db_movie.name] for db_movie in self.dbmovies.movies
+                     if db_movie.name in members_by_name), None)
     
     def get_douban_rss(self, rss_id):
         """获取豆瓣RSS数据"""
@@ -204,6 +230,12 @@ class Get_Detail:
                     logging.info(f"🗑️ 合集为空，准备重新添加电影...")
                 else:
                     logging.info(f"📋 合集包含 {len(emby_box['box_movies'])} 部电影")
+                
+                # 封面由导入器设置过时，按首部作品当前的海报刷新（来源图片标签未变化时不下载也不上传）
+                if self.emby_api.cover_sources and self.emby_api.cover_sources.has_record(box_id, 'Primary'):
+                    cover_member = self.get_cover_member(emby_box['box_members'])
+                    if cover_member:
+                        self.replace_cover_image(box_id, cover_member)
             else:
                 logging.info(f"🔨 合集不存在，开始创建: {box_name}")
                 
@@ -228,8 +260,7 @@ class Get_Detail:
                 logging.info(f"✅ 合集创建成功: {box_name} (ID: {box_id})")
                 
                 # 设置合集封面
-                image_url = f"{self.emby_server}/emby/Items/{first_movie_data['Id']}/Images/Primary?api_key={self.emby_api_key}"
-                self.replace_cover_image(box_id, image_url)
+                self.replace_cover_image(box_id, first_movie_data)
                 
                 # 初始化合集电影列表
                 emby_box = {'box_id': box_id, 'box_movies': []}
@@ -5,15 +5,24 @@ Emby 季节重命名器
 根据TMDB数据自动重命名剧集季节
 """
 import os
+import re
 import csv
-import json
 import logging
 import requests
-from typing import List, Dict, Any, Optional
-from datetime import datetime, date, timedelta
-from dateutil import parser
+from typing import List, Dict, Any, Optional, Iterator, Iterable
 from configparser import ConfigParser
 from utils import EmbyAPI
+from tmdb_api import get_tmdb_api_from_config
+from scan_state import IncrementalScanState, FINGERPRINT_FIELDS
+from writeback_buffer import get_write_buffer_from_config
+from sharding import split_shards
+from resources import EMBY_ITEMS, TMDB, EXCLUSIVE
+
+# "第x季"或"第x季 xxx"格式（不匹配"第x季节"）
+SEASON_NAME_PATTERN = re.compile(r'第\s*\d+\s*季$|第\s*\d+\s*季\s+')
+
+# 批量模式下每个季节保留的字段
+SEASON_KEYS = ('Id', 'Name', 'IndexNumber', 'SeriesId', 'SeriesName', 'LockedFields')
 
 # 配置日志
 logging.basicConfig(
@@ -39,142 +48,12 @@ else:
     os.environ.pop('http_proxy', None)
     os.environ.pop('https_proxy', None)
 
-class JsonDataBase:
-    """JSON数据库类，用于缓存TMDB数据"""
-    
-    def __init__(self, name, prefix='', db_type='dict', workdir=None):
-        self.file_name = f'{prefix}_{name}.json' if prefix else f'{name}.json'
-        self.file_path = os.path.join(workdir, self.file_name) if workdir else self.file_name
-        self.db_type = db_type
-        self.data = self.load()
-
-    def load(self, encoding='utf-8'):
-        try:
-            with open(self.file_path, encoding=encoding) as f:
-                _json = json.load(f)
-        except (FileNotFoundError, ValueError):
-            return dict(list=[], dict={})[self.db_type]
-        else:
-            return _json
-
-    def dump(self, obj, encoding='utf-8'):
-        with open(self.file_path, 'w', encoding=encoding) as f:
-            json.dump(obj, f, indent=2, ensure_ascii=False)
-
-    def save(self):
-        self.dump(self.data)
-
-class TmdbDataBase(JsonDataBase):
-    """TMDB数据缓存类"""
-    
-    def __getitem__(self, tmdb_id):
-        data = self.data.get(tmdb_id)
-        if not data:
-            return
-        
-        air_date = date.today()
-        try:
-            air_date = parser.parse(data['premiere_date']).date()
-        except Exception:
-            pass
-        
-        today = date.today()
-        if air_date + timedelta(days=30) > today:
-            expire_day = 3
-        elif air_date + timedelta(days=90) > today:
-            expire_day = 15
-        elif air_date + timedelta(days=365) > today:
-            expire_day = 30
-        else:
-            expire_day = 30
-        
-        update_date = date.fromisoformat(data['update_date'])
-        if update_date + timedelta(days=expire_day) < today:
-            return
-        
-        return data
-
-    def __setitem__(self, key, value):
-        self.data[key] = value
-        self.save()
-
-    def clean_not_trust_data(self, expire_days=7, min_trust=0.5):
-        """清理不可信数据"""
-        today = date.today()
-        keys_to_remove = []
-        for key, value in self.data.items():
-            update_date = date.fromisoformat(value['update_date'])
-            if update_date + timedelta(days=expire_days) < today:
-                keys_to_remove.append(key)
-        
-        for key in keys_to_remove:
-            del self.data[key]
-        self.save()
-
-    def save_seasons(self, tmdb_id, premiere_date, name, alt_names, seasons=None):
-        """保存季节数据"""
-        self.data[tmdb_id] = {
-            'premiere_date': premiere_date,
-            'name': name,
-            'alt_names': alt_names,
-            'seasons': seasons,
-            'update_date': date.today().isoformat()
-        }
-        self.save()
-
-class TMDBAPI:
-    """TMDB API接口类"""
-    
-    def __init__(self):
-        self.api_key = config.get('TMDB', 'tmdb_api_key')
-        self.base_url = config.get('TMDB', 'tmdb_api_base_url', fallback='https://api.themoviedb.org/3')
-        
-        # 检查API密钥
-        if not self.api_key:
-            logging.error("❌ TMDB API密钥未设置！请在config.conf的[TMDB]部分设置tmdb_api_key")
-            return
-        
-        # 检查API密钥格式
-        if not self.api_key.startswith('eyJ') and len(self.api_key) < 100:
-            logging.warning("⚠️ TMDB API密钥格式可能不正确，应该是Bearer Token格式（以eyJ开头的长字符串）")
-        
-        self.session = requests.Session()
-        self.session.headers.update({
-            "accept": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        })
-        
-        logging.info(f"🔑 TMDB API密钥已配置: {self.api_key[:20]}...")
-        logging.info(f"🌐 TMDB API基础URL: {self.base_url}")
-    
-    def get_tv_series_info(self, tmdb_id: str) -> Optional[Dict]:
-        """获取电视剧信息"""
-        if not self.api_key:
-            logging.error("❌ TMDB API密钥未设置，无法请求TMDB API")
-            return None
-            
-        try:
-            url = f"{self.base_url}/tv/{tmdb_id}?language=zh-CN&append_to_response=alternative_titles"
-            logging.info(f"🔗 TMDB API请求URL: {url}")
-            logging.info(f"🔑 TMDB API密钥: {self.api_key[:20]}..." if self.api_key else "❌ TMDB API密钥未设置")
-            
-            response = self.session.get(url, timeout=30)
-            
-            logging.info(f"📊 TMDB响应状态码: {response.status_code}")
-            if response.status_code != 200:
-                logging.error(f"❌ TMDB API请求失败: {response.status_code}")
-                logging.error(f"🔍 TMDB错误响应: {response.text[:500]}")
-                return None
-            
-            return response.json()
-                
-        except Exception as e:
-            logging.error(f"❌ 获取TMDB数据失败: {str(e)}")
-            return None
-
 class Get_Detail:
     """季节重命名器主类"""
     
+    # 运行时使用的资源（主控制器据此安排并行运行）；写回时回传整个项目，不能与其他写回项目的处理器同时运行
+    RESOURCES = {EMBY_ITEMS: EXCLUSIVE, TMDB: EXCLUSIVE}
+    
     def __init__(self):
         # 从配置文件获取配置
         self.emby_server = config.get('Server', 'emby_server')
@@ -182,6 +61,21 @@ class Get_Detail:
         self.emby_user_id = config.get('Extra', 'emby_user_id', fallback=None)
         self.library_names = config.get('SeasonRenamer', 'library_names', fallback='').split(',')
         self.dry_run = config.getboolean('SeasonRenamer', 'dry_run', fallback=True)
+        # 批量模式：每个库分页列出全部季节后按剧集分组，不再逐部剧集请求季节列表
+        self.bulk_fetch = config.getboolean('SeasonRenamer', 'bulk_fetch', fallback=True)
+        # 预检：先用命名规则检查Emby中的季节名称，只有存在不符合规则的季节时才请求TMDB
+        self.precheck = config.getboolean('SeasonRenamer', 'precheck', fallback=True)
+        self.precheck_skipped = 0
+        # 已登记写回的季节所属的剧集（写回失败时不记录剧集指纹）
+        self.season_series = {}
+        
+        # 增量模式：只处理新增或变化的剧集（包括季节有变化的剧集）
+        self.scan_state = None
+        if config.getboolean('SeasonRenamer', 'incremental', fallback=False):
+            self.scan_state = IncrementalScanState(
+                'season_renamer',
+                full_scan_interval_days=config.getint('SeasonRenamer', 'full_scan_interval_days', fallback=7)
+            )
         
         # 检查TMDB API密钥
         tmdb_api_key = config.get('TMDB', 'tmdb_api_key', fallback='')
@@ -195,17 +89,28 @@ class Get_Detail:
             emby_api_key=self.emby_api_key,
             emby_user_id=self.emby_user_id
         )
-        self.tmdb_api = TMDBAPI()
-        
-        # 初始化缓存
-        self.tmdb_db = TmdbDataBase('tmdb_seasons', 'season_renamer')
+        # TMDB客户端与国家标签抓取器共用（同一会话、同一缓存）
+        self.tmdb_api = get_tmdb_api_from_config(config)
+        # 写回缓冲区与国家标签抓取器、类型映射器共用（预览模式下只输出写回计划）
+        self.write_buffer = get_write_buffer_from_config(config, self.emby_api, 'SeasonRenamer', 'season_renamer')
         
         self.process_count = 0
+        self.item_count = 0
+        self.tmdb_count = 0
     
     def get_or_default(self, _dict, key, default=None):
         """安全获取字典值"""
         return _dict.get(key, default)
     
+    def _season_name_conforms(self, current_name: str, season_index: int) -> bool:
+        """季节名称是否已符合命名规则（无需TMDB数据即可判断）
+        
+        特别篇（season_number为0）的名称取决于TMDB，这里视为符合规则
+        """
+        if season_index == 0:
+            return True
+        return bool(SEASON_NAME_PATTERN.search(current_name or ''))
+    
     def _get_smart_season_name(self, current_name: str, tmdb_name: str, season_index: int) -> str:
         """智能生成季节名称
         
@@ -215,8 +120,6 @@ class Get_Detail:
         3. 如果当前名称不包含季数（只有名字），则修改为"第x季 xxx"格式
         4. 特别篇（season_number为0）不添加季数标注
         """
-        import re
-        
         # 特别篇（season_number为0）不添加季数标注
         if season_index == 0:
             if tmdb_name and tmdb_name.strip():
@@ -225,8 +128,7 @@ class Get_Detail:
                 return current_name
         
         # 检查当前名称是否已经包含季数格式（只匹配"第x季"，不匹配"第x季节"）
-        season_pattern = re.compile(r'第\s*\d+\s*季$|第\s*\d+\s*季\s+')
-        if season_pattern.search(current_name):
+        if self._season_name_conforms(current_name, season_index):
             # 当前名称已经包含正确的季数格式，保持不变
             return current_name
         
@@ -249,48 +151,46 @@ class Get_Detail:
     
     def get_season_info_from_tmdb(self, tmdb_id: str, is_movie: bool, series_name: str):
         """从TMDB获取季节信息"""
-        cache_key = ('mv' if is_movie else 'tv') + f'{tmdb_id}'
-        cache_data = self.tmdb_db[cache_key]
-        
-        if cache_data:
-            alt_names = cache_data['seasons']
-            return alt_names, True
-        
         if is_movie:
             logging.warning(f"⚠️ 电影不支持季节重命名: {series_name}")
             return None, None
         
-        # 获取电视剧信息
-        resp_json = self.tmdb_api.get_tv_series_info(tmdb_id)
-        if not resp_json:
+        tmdb_data, is_cache = self.tmdb_api.get_item_info(tmdb_id, series_name, is_movie=False)
+        if not tmdb_data or not tmdb_data.get('seasons'):
             return None, None
         
-        if 'seasons' in resp_json:
-            titles = resp_json.get("alternative_titles", {})
-            release_date = self.get_or_default(
-                resp_json, 'last_air_date', 
-                default=self.get_or_default(resp_json, 'first_air_date')
-            )
-            alt_names = self.get_or_default(titles, "results", None)
-            
-            self.tmdb_db.save_seasons(
-                cache_key, 
-                premiere_date=release_date,
-                name=series_name, 
-                alt_names=alt_names, 
-                seasons=resp_json['seasons']
-            )
-            return resp_json['seasons'], False
-        else:
-            return None, None
+        return tmdb_data['seasons'], is_cache
     
-    def rename_seasons(self, parent_id: str, tmdb_id: str, series_name: str, is_movie: bool):
-        """重命名季节"""
+    def rename_seasons(self, parent_id: str, tmdb_id: str, series_name: str, is_movie: bool,
+                       seasons: List[Dict] = None):
+        """重命名季节
+        
+        seasons 为批量模式下预先列出的该剧集的季节；为None时按ParentId单独获取
+        """
         # 如果是电影，跳过（电影没有季节）
         if is_movie:
             logging.debug(f"📽️ 跳过电影: {series_name} (电影不支持季节重命名)")
             return
         
+        # 获取Emby中的季节信息
+        if seasons is None:
+            seasons_url = f"{self.emby_server}/emby/Items?ParentId={parent_id}&api_key={self.emby_api_key}"
+            response = requests.get(seasons_url)
+            if response.status_code != 200:
+                logging.error(f"❌ 获取季节列表失败: {response.status_code}")
+                return
+            
+            seasons = response.json()['Items']
+        
+        # 预检：所有非特别篇季节的名称都已符合规则时，不需要请求TMDB
+        if self.precheck and all(
+            'IndexNumber' not in season or self._season_name_conforms(season['Name'], season['IndexNumber'])
+            for season in seasons
+        ):
+            self.precheck_skipped += 1
+            logging.debug(f"⏭️ {series_name} 的季节名称均符合规则，跳过TMDB查询")
+            return
+        
         tmdb_seasons, is_cache = self.get_season_info_from_tmdb(tmdb_id, is_movie, series_name)
         from_cache = ' (缓存)' if is_cache else ''
         
@@ -298,15 +198,6 @@ class Get_Detail:
             logging.error(f"❌ TMDB中未找到季节信息: {tmdb_id} {series_name}")
             return
         
-        # 获取Emby中的季节信息
-        seasons_url = f"{self.emby_server}/emby/Items?ParentId={parent_id}&api_key={self.emby_api_key}"
-        response = requests.get(seasons_url)
-        if response.status_code != 200:
-            logging.error(f"❌ 获取季节列表失败: {response.status_code}")
-            return
-        
-        seasons = response.json()['Items']
-        
         for season in seasons:
             season_id = season['Id']
             season_name = season['Name']
@@ -322,45 +213,48 @@ class Get_Detail:
                 None
             )
             
-            if tmdb_season:
-                tmdb_season_name = tmdb_season['name']
-                
-                # 获取单个季节详细信息
-                season_detail_url = f"{self.emby_server}/emby/Users/{self.emby_user_id}/Items/{season_id}?Fields=ChannelMappingInfo&api_key={self.emby_api_key}"
-                season_response = requests.get(season_detail_url)
-                if season_response.status_code != 200:
-                    logging.error(f"❌ 获取季节详情失败: {season_response.status_code}")
-                    continue
-                
-                single_season = season_response.json()
-                
-                if 'Name' in single_season:
-                    # 智能重命名逻辑
-                    new_season_name = self._get_smart_season_name(season_name, tmdb_season_name, season_index)
-                    
-                    if season_name == new_season_name:
-                        if not self.dry_run:
-                            logging.info(f"✅ {series_name} 第{season_index}季{from_cache} [{season_name}] 季名一致，跳过更新")
-                        continue
-                    else:
-                        logging.info(f"🔄 {series_name} 第{season_index}季{from_cache} 将从 [{season_name}] 更名为 [{new_season_name}]")
-                    
-                    single_season['Name'] = new_season_name
-                    
-                    if 'LockedFields' not in single_season:
-                        single_season['LockedFields'] = []
-                    if 'Name' not in single_season['LockedFields']:
-                        single_season['LockedFields'].append('Name')
-                    
-                    if not self.dry_run:
-                        update_url = f"{self.emby_server}/emby/Items/{season_id}?api_key={self.emby_api_key}&reqformat=json"
-                        update_response = requests.post(update_url, json=single_season)
-                        
-                        if update_response.status_code in [200, 204]:
-                            self.process_count += 1
-                            logging.info(f"✅ 成功更新 {series_name} {season_name}")
-                        else:
-                            logging.error(f"❌ 更新失败 {series_name} {season_name}: {update_response.status_code}")
+            if not tmdb_season:
+                continue
+            
+            # 智能重命名逻辑（先用列表中的名称比较，只有需要改名的季节才登记写回）
+            new_season_name = self._get_smart_season_name(season_name, tmdb_season['name'], season_index)
+            
+            if season_name == new_season_name:
+                if not self.dry_run:
+                    logging.info(f"✅ {series_name} 第{season_index}季{from_cache} [{season_name}] 季名一致，跳过更新")
+                continue
+            else:
+                logging.info(f"🔄 {series_name} 第{season_index}季{from_cache} 将从 [{season_name}] 更名为 [{new_season_name}]")
+            
+            # 登记到写回缓冲区，刷新时再获取详情并一次写回（预览模式下写入写回计划）
+            self.write_buffer.set_name(season_id, new_season_name, label=f"{series_name} {season_name}",
+                                       current_name=season_name)
+            self.write_buffer.lock_fields(season_id, ['Name'])
+            self.season_series[season_id] = parent_id
+            self.process_count += 1
+    
+    def get_library_seasons(self, library_id: str) -> Dict[str, List[Dict]]:
+        """批量模式：分页列出库中所有季节，并按剧集分组"""
+        seasons = self.emby_api.iter_items({
+            'ParentId': library_id,
+            'Recursive': 'true',
+            'IncludeItemTypes': 'Season',
+            'Fields': 'LockedFields',
+            'EnableImages': 'false',
+            'EnableUserData': 'false'
+        })
+        
+        # 只保留重命名需要的字段，避免在内存中保留完整的季节列表
+        season_groups = {}
+        season_count = 0
+        for season in seasons:
+            season_count += 1
+            season_groups.setdefault(season.get('SeriesId'), []).append(
+                {key: season[key] for key in SEASON_KEYS if key in season}
+            )
+        
+        logging.info(f"📦 批量获取到 {season_count} 个季节，分属 {len(season_groups)} 部剧集")
+        return season_groups
     
     def get_library_id(self, name: str) -> Optional[str]:
         """获取库ID"""
@@ -386,40 +280,142 @@ class Get_Detail:
             logging.error(f"❌ 获取库ID失败: {str(e)}")
             return None
     
-    def get_library_items(self, parent_id: str) -> List[Dict]:
-        """获取库中的项目（递归获取）"""
-        try:
-            params = {
-                'ParentId': parent_id,
-                'fields': 'ProviderIds'
-            }
+    def library_query(self, parent_id: str) -> Dict:
+        """库中剧集的列表查询参数（按名称排序，保证分片范围稳定）"""
+        return {
+            'ParentId': parent_id,
+            'Recursive': 'true',
+            'IncludeItemTypes': 'Series',
+            'Fields': 'ProviderIds',
+            'SortBy': 'SortName',
+            'EnableImages': 'false',
+            'EnableUserData': 'false'
+        }
+    
+    def get_library_items(self, parent_id: str, start_index: int = 0, max_items: int = None) -> Iterator[Dict]:
+        """流式获取库中的剧集（分页拉取，逐页处理后释放，内存占用与库大小无关）"""
+        return self.emby_api.iter_items(self.library_query(parent_id), start_index=start_index, max_items=max_items)
+    
+    def get_incremental_series(self, library_id: str) -> List[Dict]:
+        """增量模式：获取新增或变化的剧集，以及季节有变化的剧集"""
+        # 单次遍历变化项目（全量扫描时为流式列表），边记录指纹边归类
+        series = {}
+        season_series_ids = set()
+        for item in self.scan_state.collect_items(self.emby_api, library_id, 'Series,Season'):
+            self.scan_state.record_item(library_id, item)
+            if item['Type'] == 'Series':
+                series[item['Id']] = item
+            elif item['Type'] == 'Season' and item.get('SeriesId'):
+                season_series_ids.add(item['SeriesId'])
+        
+        # 季节有变化时，其所属剧集也需要处理
+        season_series_ids -= set(series)
+        if season_series_ids:
+            # 按Id分块批量获取（每100个一次请求），避免Id过多时URL超长
+            series.update(self.emby_api.get_items_by_ids(sorted(season_series_ids), fields=FINGERPRINT_FIELDS))
+        
+        return list(series.values())
+    
+    def process_library(self, library_id: str, items: Iterable[Dict], season_groups: Dict[str, List[Dict]] = None):
+        """逐个处理库中的剧集，计数随处理累加；批量模式下第一次遇到剧集时再列出季节
+
+        season_groups 为分片时父进程分配的本分片剧集的季节（已提供时不再列出整个库的季节）
+        """
+        total_count = 0
+        tmdb_count = 0
+        for item in items:
+            total_count += 1
+            # 调试：打印ProviderIds信息
+            provider_ids = item.get('ProviderIds', {})
+            logging.debug(f"🔍 项目 {item['Name']} 的ProviderIds: {provider_ids}")
             
-            response = requests.get(
-                f"{self.emby_server}/emby/Items",
-                headers={'X-Emby-Token': self.emby_api_key},
-                params=params
-            )
+            tmdb_id = provider_ids.get('Tmdb')
+            if not tmdb_id:
+                logging.debug(f"⏭️ 跳过项目 {item['Name']}: 没有TMDB ID")
+                continue
+            tmdb_count += 1
             
-            if response.status_code != 200:
-                logging.error(f"❌ 获取库项目失败: {response.status_code}")
-                return []
+            item_name = item['Name']
+            item_id = item['Id']
+            is_movie = item['Type'] == 'Movie'
             
-            items = response.json().get('Items', [])
+            # 跳过电影，只处理电视剧
+            if is_movie:
+                logging.debug(f"📽️ 跳过电影: {item_name}")
+                continue
             
-            # 分离文件夹和普通项目
-            items_folder = [item for item in items if item["Type"] == "Folder"]
-            items_normal = [item for item in items if item["Type"] != "Folder"]
+            logging.info(f"🎬 处理项目: {item_name} (TMDB: {tmdb_id})")
+            if self.bulk_fetch and season_groups is None:
+                season_groups = self.get_library_seasons(library_id)
+            seasons = season_groups.get(item_id, []) if season_groups is not None else None
+            self.rename_seasons(item_id, tmdb_id, item_name, is_movie, seasons=seasons)
+        
+        self.item_count += total_count
+        self.tmdb_count += tmdb_count
+        logging.info(f"📋 找到 {total_count} 个项目，其中 {tmdb_count} 个项目有TMDB ID")
+    
+    def stats(self) -> Dict:
+        """运行统计（分片执行时由主控制器汇总）"""
+        return {
+            'items': self.item_count,
+            'with_tmdb': self.tmdb_count,
+            'processed': self.process_count,
+            'precheck_skipped': self.precheck_skipped
+        }
+    
+    def plan_shards(self, workers: int, min_shard_size: int) -> List[Dict]:
+        """分片执行：按 StartIndex 范围拆分各库；增量模式下不分片，返回空列表"""
+        if self.scan_state or not self.library_names or not self.library_names[0]:
+            return []
+        
+        # 缓存淘汰在父进程中执行一次，各分片进程沿用同步结果直接使用缓存
+        if config.getboolean('TMDB', 'use_changes_api', fallback=False):
+            self.tmdb_api.sync_changes()
+        tracking_since = self.tmdb_api.tracking_since()
+        
+        shards = []
+        for library_name in self.library_names:
+            library_name = library_name.strip()
+            library_id = self.get_library_id(library_name)
+            if not library_id:
+                continue
+            total = self.emby_api.count_items(self.library_query(library_id)) or 0
+            ranges = split_shards(total, workers, min_shard_size)
             
-            # 递归获取文件夹中的项目
-            for folder in items_folder:
-                folder_items = self.get_library_items(folder['Id'])
-                items_normal.extend(folder_items)
+            # 批量模式：父进程只列出一次季节，按分片范围内的剧集分给各分片（不再每个分片各列一遍整个库）
+            series_ids = season_groups = None
+            if self.bulk_fetch and len(ranges) > 1:
+                series_ids = [item['Id'] for item in self.get_library_items(library_id)]
+                season_groups = self.get_library_seasons(library_id)
             
-            return items_normal
-                
-        except Exception as e:
-            logging.error(f"❌ 获取库项目异常: {str(e)}")
-            return []
+            for start_index, limit in ranges:
+                shard = {
+                    'index': len(shards),
+                    'library_name': library_name,
+                    'library_id': library_id,
+                    'start_index': start_index,
+                    'limit': limit,
+                    'tmdb_tracking_since': tracking_since
+                }
+                if season_groups is not None:
+                    shard['season_groups'] = {
+                        series_id: season_groups[series_id]
+                        for series_id in series_ids[start_index:start_index + limit] if series_id in season_groups
+                    }
+                shards.append(shard)
+        return shards
+    
+    def run_shard(self, shard: Dict) -> Dict:
+        """处理一个分片（在子进程中运行），返回统计"""
+        logging.info(f"📚 处理库分片: {shard['library_name']} "
+                     f"[{shard['start_index']}, {shard['start_index'] + shard['limit']})")
+        items = self.get_library_items(shard['library_id'], shard['start_index'], shard['limit'])
+        self.process_library(shard['library_id'], items, season_groups=shard.get('season_groups'))
+        
+        if self.write_buffer.dry_run:
+            self.write_buffer.plan_name = f"{self.write_buffer.plan_name}_shard{shard['index']}"
+        self.write_buffer.flush_if_idle()
+        return self.stats()
     
     def run(self):
         """运行重命名器"""
@@ -427,7 +423,11 @@ class Get_Detail:
         
         if not self.library_names or not self.library_names[0]:
             logging.error("❌ 未配置库名称")
-            return
+            return self.stats()
+        
+        # 根据TMDB变更列表淘汰缓存，未变更的条目可长期使用
+        if config.getboolean('TMDB', 'use_changes_api', fallback=False):
+            self.tmdb_api.sync_changes()
         
         for library_name in self.library_names:
             library_name = library_name.strip()
@@ -442,36 +442,27 @@ class Get_Detail:
                 continue
             
             # 获取库中的项目
-            items = self.get_library_items(library_id)
-            logging.info(f"📋 找到 {len(items)} 个项目")
-            
-            # 统计有TMDB ID的项目
-            items_with_tmdb = [item for item in items if item.get('ProviderIds', {}).get('Tmdb')]
-            logging.info(f"🎯 其中 {len(items_with_tmdb)} 个项目有TMDB ID")
+            if self.scan_state:
+                items = self.get_incremental_series(library_id)
+            else:
+                items = self.get_library_items(library_id)
             
-            for item in items:
-                # 调试：打印ProviderIds信息
-                provider_ids = item.get('ProviderIds', {})
-                logging.debug(f"🔍 项目 {item['Name']} 的ProviderIds: {provider_ids}")
-                
-                tmdb_id = provider_ids.get('Tmdb')
-                if not tmdb_id:
-                    logging.debug(f"⏭️ 跳过项目 {item['Name']}: 没有TMDB ID")
-                    continue
-                
-                item_name = item['Name']
-                item_id = item['Id']
-                is_movie = item['Type'] == 'Movie'
-                
-                # 跳过电影，只处理电视剧
-                if is_movie:
-                    logging.debug(f"📽️ 跳过电影: {item_name}")
-                    continue
-                
-                logging.info(f"🎬 处理项目: {item_name} (TMDB: {tmdb_id})")
-                self.rename_seasons(item_id, tmdb_id, item_name, is_movie)
+            # 边拉取边处理
+            self.process_library(library_id, items)
+            if self.scan_state:
+                self.scan_state.finish(library_id)
         
+        if self.precheck:
+            logging.info(f"⏭️ 预检跳过了 {self.precheck_skipped} 部季节名称已符合规则的剧集")
+        # 写回完成后再保存增量状态（写回被主控制器暂缓时在整批写回后保存），预览模式下不保存；
+        # 季节写回失败时其所属剧集也不记录指纹
+        if self.scan_state and not self.write_buffer.dry_run:
+            self.write_buffer.after_flush(lambda failed_ids: self.scan_state.commit(
+                set(failed_ids) | {self.season_series[season_id] for season_id in failed_ids if season_id in self.season_series}
+            ))
+        self.write_buffer.flush_if_idle()
         logging.info(f"✅ 季节重命名器运行完成，处理了 {self.process_count} 个季节")
+        return self.stats()
 
 if __name__ == "__main__":
     logging.info("执行单次任务")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+拼图合集封面
+用合集成员的海报缩略图（服务端缩放后下载）拼成 2×2 或 3×3 的封面；拼图在进程池中渲染，不阻塞下载和上传。
+拼图按参与拼接的成员图片标签计算哈希：成员和海报都没变化时不重新渲染，也不重新上传
+"""
+import io
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from configparser import ConfigParser
+from typing import Dict, List, Optional, Tuple
+from utils import EmbyAPI, item_image_tag
+from image_cache import ImageCache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# 拼图封面在封面来源记录中的来源Id
+COLLAGE_SOURCE_ID = 'collage'
+
+def render_collage(posters: List[bytes], grid: int, tile_size: Tuple[int, int], quality: int) -> bytes:
+    """把海报按行拼成 grid×grid 的JPEG（在子进程中运行）"""
+    width, height = tile_size
+    canvas = Image.new('RGB', (width * grid, height * grid))
+    for index, content in enumerate(posters[:grid * grid]):
+        with Image.open(io.BytesIO(content)) as poster:
+            tile = ImageOps.fit(poster.convert('RGB'), tile_size)
+        canvas.paste(tile, ((index % grid) * width, (index // grid) * height))
+    output = io.BytesIO()
+    canvas.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+class CollageBuilder:
+    """拼图封面生成器：提交的合集在进程池中渲染，finish() 时统一上传"""
+
+    def __init__(self, emby_api: EmbyAPI, grid: int = 3, tile_width: int = 300, quality: int = 85,
+                 workers: int = 2):
+        self.emby_api = emby_api
+        self.grid = grid
+        self.tile_size = (tile_width, tile_width * 3 // 2)
+        self.quality = quality
+        self.workers = max(1, workers)
+        self._pool = None
+        self._pending = []
+        self.counts = {'rendered': 0, 'cached': 0, 'unchanged': 0, 'uploaded': 0, 'failed': 0}
+
+    @property
+    def available(self) -> bool:
+        """未安装Pillow时无法生成拼图"""
+        return Image is not None
+
+    def _grid_for(self, count: int) -> Optional[int]:
+        """成员海报不足时退回 2×2，连4张都不够时不生成拼图"""
+        for grid in (self.grid, 2):
+            if count >= grid * grid:
+                return grid
+        return None
+
+    def collage_key(self, members: List[Tuple[str, str]], grid: int) -> str:
+        """拼图哈希：参与拼接的 (成员Id, 海报标签) 和拼图尺寸"""
+        parts = [f"{item_id}:{tag}" for item_id, tag in members]
+        parts.append(f"{grid}x{grid}@{self.tile_size[0]}x{self.tile_size[1]}q{self.quality}")
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def _thumbnail_params(self) -> Dict:
+        return {'maxWidth': self.tile_size[0], 'maxHeight': self.tile_size[1], 'quality': self.quality}
+
+    def submit(self, collection_id: str, items: List[Dict]):
+        """为合集安排拼图封面：items 为合集成员（需带 ImageTags），按顺序取前 grid×grid 张海报"""
+        members = [(item['Id'], item_image_tag(item, 'Primary')) for item in items]
+        members = [(item_id, tag) for item_id, tag in members if tag]
+        grid = self._grid_for(len(members))
+        if not grid:
+            logging.info(f"⏭️ 合集 {collection_id} 的成员海报不足4张，不生成拼图封面")
+            return
+        members = members[:grid * grid]
+        key = self.collage_key(members, grid)
+
+        cover_sources = self.emby_api.cover_sources
+        if cover_sources and cover_sources.unchanged(collection_id, 'Primary', COLLAGE_SOURCE_ID, key):
+            logging.info(f"⏭️ 合集 {collection_id} 的拼图成员未变化，跳过")
+            self.counts['unchanged'] += 1
+            return
+
+        image_cache = self.emby_api.image_cache
+        cache_key = ImageCache.key(COLLAGE_SOURCE_ID, 'Primary', key) if image_cache else None
+        cached = image_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            self.counts['cached'] += 1
+            future = Future()
+            future.set_result(cached)
+            self._pending.append((collection_id, key, None, future))
+            return
+
+        posters = []
+        for item_id, tag in members:
+            content = self.emby_api.download_item_image(item_id, 'Primary', tag, params=self._thumbnail_params())
+            if content is None:
+                logging.warning(f"⚠️ 合集 {collection_id} 的成员海报下载失败，不生成拼图封面")
+                self.counts['failed'] += 1
+                return
+            posters.append(content)
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        future = self._pool.submit(render_collage, posters, grid, self.tile_size, self.quality)
+        self.counts['rendered'] += 1
+        self._pending.append((collection_id, key, cache_key, future))
+
+    def finish(self) -> Dict:
+        """等待所有拼图渲染完成并上传，返回计数"""
+        for collection_id, key, cache_key, future in self._pending:
+            try:
+                content = future.result()
+            except Exception as e:
+                logging.error(f"❌ 合集 {collection_id} 的拼图渲染失败: {str(e)}")
+                self.counts['failed'] += 1
+                continue
+            # cache_key 只在新渲染的拼图上设置（缓存命中的拼图无需再写入）
+            if cache_key:
+                self.emby_api.image_cache.put(cache_key, content)
+
+            if self.emby_api.upload_item_image(collection_id, 'Primary', content):
+                self.counts['uploaded'] += 1
+                if self.emby_api.cover_sources:
+                    self.emby_api.cover_sources.record(collection_id, 'Primary', COLLAGE_SOURCE_ID, key)
+            else:
+                self.counts['failed'] += 1
+        self._pending = []
+
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        logging.info(f"🧩 拼图封面: {self.counts}")
+        return dict(self.counts)
+
+def get_collage_builder_from_config(config: ConfigParser, emby_api: EmbyAPI) -> Optional[CollageBuilder]:
+    """按config.conf的[CollageCover]部分创建拼图封面生成器，未启用或未安装Pillow时返回None"""
+    if not config.getboolean('CollageCover', 'enabled', fallback=False):
+        return None
+    builder = CollageBuilder(
+        emby_api,
+        grid=config.getint('CollageCover', 'grid', fallback=3),
+        tile_width=config.getint('CollageCover', 'tile_width', fallback=300),
+        quality=config.getint('CollageCover', 'quality', fallback=85),
+        workers=config.getint('CollageCover', 'render_workers', fallback=2)
+    )
+    if not builder.available:
+        logging.warning("⚠️ 未安装Pillow，无法生成拼图封面，继续使用单张海报")
+        return None
+    return builder
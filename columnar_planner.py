@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列式变更规划器
+把一批项目（库列表 + TMDB缓存）装入 pandas DataFrame，用向量化操作一次性算出
+国家/语言标签和类型映射的变更列表，代替逐项目的Python循环
+"""
+import pandas as pd
+from typing import Dict
+
+# 每批装入DataFrame的项目数（流式处理时按批规划，内存占用与库大小无关）
+COLUMNAR_BATCH_SIZE = 5000
+
+# 无法识别的代码在展开前的占位值（不在任何映射表中，映射后归为默认标签）
+UNKNOWN_CODE = ''
+
+def _explode(frame: pd.DataFrame, column: str) -> pd.DataFrame:
+    """把列表列展开为 (item_id, value) 长表，去掉空值"""
+    exploded = frame[['item_id', column]].explode(column)
+    return exploded.dropna(subset=[column]).rename(columns={column: 'value'})
+
+def desired_tags(frame: pd.DataFrame, column: str, mapping: Dict[str, str], default: str) -> pd.DataFrame:
+    """把代码列映射为标签，同一项目去重；映射出的标签超过两种时不使用默认标签（如"其他国家"）
+
+    无法识别的代码（None，如映射不到的制片国家）与逐项目流程一致归为默认标签，展开前先替换，避免被当作空值丢弃
+    """
+    frame = frame[['item_id', column]].assign(
+        **{column: frame[column].map(lambda values: [UNKNOWN_CODE if value is None else value for value in values])}
+    )
+    codes = _explode(frame, column)
+    codes['tag'] = codes['value'].map(mapping).fillna(default)
+    tags = codes.drop_duplicates(['item_id', 'tag'])
+    tag_counts = tags.groupby('item_id')['tag'].transform('size')
+    return tags.loc[(tags['tag'] != default) | (tag_counts <= 2), ['item_id', 'tag']]
+
+def plan_tag_additions(frame: pd.DataFrame, country_mapping: Dict[str, str], language_mapping: Dict[str, str],
+                       default_country: str, default_language: str) -> pd.Series:
+    """计算每个项目需要追加的标签
+
+    frame 需要包含 item_id、tags（当前标签）、country_codes、language_codes 四列（后三列为列表），
+    返回以 item_id 为索引、值为待追加标签列表的 Series（国家在前、语言在后），无需修改的项目不出现
+    """
+    if frame.empty:
+        return pd.Series(dtype=object)
+
+    desired = pd.concat([
+        desired_tags(frame, 'country_codes', country_mapping, default_country),
+        desired_tags(frame, 'language_codes', language_mapping, default_language)
+    ], ignore_index=True)
+    existing = _explode(frame, 'tags').rename(columns={'value': 'tag'}).drop_duplicates()
+
+    merged = desired.merge(existing, on=['item_id', 'tag'], how='left', indicator=True)
+    additions = merged.loc[merged['_merge'] == 'left_only']
+    return additions.groupby('item_id', sort=False)['tag'].agg(list)
+
+def plan_genre_maps(frame: pd.DataFrame, reverse_mapping: Dict[str, str]) -> pd.Series:
+    """计算每个项目的类型映射
+
+    frame 需要包含 item_id、genres（列表）两列，返回以 item_id 为索引、值为 {旧类型: 新类型} 的 Series
+    """
+    if frame.empty:
+        return pd.Series(dtype=object)
+
+    genres = _explode(frame, 'genres')
+    genres['new'] = genres['value'].map(reverse_mapping)
+    mapped = genres.dropna(subset=['new']).drop_duplicates(['item_id', 'value'])
+
+    # 只对需要映射的行组装字典
+    genre_maps = {}
+    for item_id, old_genre, new_genre in zip(mapped['item_id'], mapped['value'], mapped['new']):
+        genre_maps.setdefault(item_id, {})[old_genre] = new_genre
+    return pd.Series(genre_maps, dtype=object)
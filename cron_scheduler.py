@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cron 调度器
+用最小堆保存各任务的下次触发时间（croniter 按配置时区计算），主循环只睡到最早的触发时间，
+完整支持分钟、小时、日、月、星期字段；错过触发时间（如上一个任务运行过久）时按补偿策略处理
+"""
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+from croniter import croniter
+
+# 错过触发时间后的补偿策略
+MISFIRE_RUN_ONCE = 'run_once'   # 补跑一次（多次错过只补一次），然后从当前时间继续
+MISFIRE_SKIP = 'skip'           # 不补跑，直接等下一个触发时间
+MISFIRE_POLICIES = (MISFIRE_RUN_ONCE, MISFIRE_SKIP)
+
+class CronJob:
+    """一个cron任务"""
+
+    def __init__(self, name: str, cron_expression: str, func: Callable, args: Tuple = ()):
+        if not croniter.is_valid(cron_expression):
+            raise ValueError(f"cron表达式无效: {cron_expression}")
+        self.name = name
+        self.cron_expression = cron_expression
+        self.func = func
+        self.args = args
+
+    def next_fire(self, after: datetime) -> datetime:
+        """after 之后的下一个触发时间（与 after 同一时区）"""
+        return croniter(self.cron_expression, after).get_next(datetime)
+
+class CronScheduler:
+    """基于最小堆的cron调度器（任务在调度线程中依次运行）
+
+    after_pending 在每轮到期任务运行完后调用一次，可用于把同一时刻触发的任务作为一批提交
+    """
+
+    def __init__(self, timezone, misfire_policy: str = MISFIRE_RUN_ONCE, misfire_grace_seconds: int = 300,
+                 after_pending: Optional[Callable[[], None]] = None):
+        if misfire_policy not in MISFIRE_POLICIES:
+            raise ValueError(f"未知的补偿策略: {misfire_policy}")
+        self.timezone = timezone
+        self.misfire_policy = misfire_policy
+        self.misfire_grace = timedelta(seconds=misfire_grace_seconds)
+        self.after_pending = after_pending
+        self._heap: List[Tuple[float, int, datetime, CronJob]] = []
+        self._seq = 0
+        self._stop = threading.Event()
+
+    def now(self) -> datetime:
+        return datetime.now(self.timezone)
+
+    def _push(self, job: CronJob, fire_time: datetime):
+        self._seq += 1
+        heapq.heappush(self._heap, (fire_time.timestamp(), self._seq, fire_time, job))
+
+    def add_job(self, name: str, cron_expression: str, func: Callable, *args) -> datetime:
+        """添加任务，返回首次触发时间；cron表达式无效时抛出 ValueError"""
+        job = CronJob(name, cron_expression, func, args)
+        fire_time = job.next_fire(self.now())
+        self._push(job, fire_time)
+        return fire_time
+
+    def next_fire_time(self):
+        """最早的触发时间，没有任务时为None"""
+        return self._heap[0][2] if self._heap else None
+
+    def stop(self):
+        """停止调度循环（可从其他线程调用）"""
+        self._stop.set()
+
+    def _run_job(self, job: CronJob):
+        try:
+            job.func(*job.args)
+        except Exception as e:
+            logging.error(f"❌ {job.name} 调度任务异常: {str(e)}")
+
+    def run_pending(self):
+        """运行所有已到触发时间的任务，并按补偿策略安排下一次"""
+        now = self.now()
+        fired = False
+        while self._heap and self._heap[0][0] <= now.timestamp():
+            fired = True
+            _, _, fire_time, job = heapq.heappop(self._heap)
+            late = now - fire_time
+            if late > self.misfire_grace and self.misfire_policy == MISFIRE_SKIP:
+                logging.warning(f"⚠️ {job.name} 错过触发时间 {fire_time.strftime('%Y-%m-%d %H:%M:%S')}，跳过")
+            else:
+                if late > self.misfire_grace:
+                    logging.warning(f"⚠️ {job.name} 错过触发时间 {fire_time.strftime('%Y-%m-%d %H:%M:%S')}，补跑一次")
+                self._run_job(job)
+            # 下次触发时间从当前时间开始计算，多次错过的触发合并为一次
+            now = self.now()
+            next_time = job.next_fire(max(fire_time, now))
+            self._push(job, next_time)
+            logging.info(f"⏰ {job.name} 下次运行时间: {next_time.strftime('%Y-%m-%d %H:%M:%S %Z')}")
+
+        if fired and self.after_pending:
+            try:
+                self.after_pending()
+            except Exception as e:
+                logging.error(f"❌ 调度批次提交异常: {str(e)}")
+
+    def run_forever(self):
+        """主循环：睡到最早的触发时间（stop() 可提前唤醒），没有任务时一直等待"""
+        while not self._stop.is_set():
+            if not self._heap:
+                self._stop.wait()
+                continue
+            delay = self._heap[0][0] - self.now().timestamp()
+            if delay > 0:
+                # 被提前唤醒或系统时间变化时重新计算
+                self._stop.wait(delay)
+                continue
+            self.run_pending()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地图片缓存
+按 (项目Id, 图片类型, ImageTag, 缩放参数) 寻址保存下载过的图片；Emby的图片标签不变时直接命中，
+不再重复下载同一张子项目海报；流式上传时直接读取缓存文件或边下载边写入缓存。总大小超过上限时按最近使用时间淘汰；
+另外记录每个合集封面来自哪个项目的哪个图片标签，来源未变化时不再下载和上传
+"""
+import os
+import hashlib
+import logging
+import threading
+from configparser import ConfigParser
+from typing import BinaryIO, Dict, Optional
+from utils import JsonDataBase
+
+class CacheWriter:
+    """分块写入一个缓存条目：先写临时文件，commit() 时替换为正式文件（多进程共用目录也不会读到半个文件）"""
+
+    def __init__(self, cache: 'ImageCache', key: str):
+        self.cache = cache
+        self.path = cache._path(key)
+        self.tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self.size = 0
+        try:
+            self._file = open(self.tmp_path, 'wb')
+        except OSError as e:
+            logging.warning(f"⚠️ 写入图片缓存失败: {str(e)}")
+            self._file = None
+
+    def write(self, chunk: bytes):
+        """写入一块（写入失败时放弃本条目，不影响上传）"""
+        if self._file is None:
+            return
+        try:
+            self._file.write(chunk)
+            self.size += len(chunk)
+        except OSError as e:
+            logging.warning(f"⚠️ 写入图片缓存失败: {str(e)}")
+            self.discard()
+
+    def commit(self):
+        """完整写入后生效并按上限淘汰"""
+        if self._file is None:
+            return
+        file, self._file = self._file, None
+        try:
+            file.close()
+            os.replace(self.tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"⚠️ 写入图片缓存失败: {str(e)}")
+            self._remove_tmp()
+            return
+        self.cache._added(self.size)
+
+    def discard(self):
+        """放弃未完成的条目（已 commit 时无操作）"""
+        if self._file is None:
+            return
+        file, self._file = self._file, None
+        file.close()
+        self._remove_tmp()
+
+    def _remove_tmp(self):
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+class ImageCache:
+    """按内容寻址的图片缓存（LRU按总大小淘汰）"""
+
+    def __init__(self, cache_dir: str = 'image_cache', max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total = sum(entry.stat().st_size for entry in os.scandir(cache_dir)
+                          if entry.is_file() and entry.name.endswith('.img'))
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(item_id: str, image_type: str, image_tag: str, params: Dict = None) -> str:
+        """缓存键：图片标签相同、缩放参数相同的图片内容相同"""
+        parts = [item_id, image_type, image_tag]
+        parts.extend(f"{name}={value}" for name, value in sorted((params or {}).items()))
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.img")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取缓存并刷新最近使用时间，未命中返回None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return content
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """以文件方式打开缓存并刷新最近使用时间（流式上传直接从文件读取），未命中返回None"""
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return f
+
+    def writer(self, key: str) -> CacheWriter:
+        """分块写入一个缓存条目（流式下载时边下载边写入）"""
+        return CacheWriter(self, key)
+
+    def put(self, key: str, content: bytes):
+        """写入缓存，超出上限时淘汰"""
+        writer = self.writer(key)
+        writer.write(content)
+        writer.commit()
+
+    def _added(self, size: int):
+        with self._lock:
+            self._total += size
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """按最近使用时间从旧到新删除，直到总大小回到上限的90%以内"""
+        entries = sorted(
+            (entry for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.name.endswith('.img')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        total = sum(entry.stat().st_size for entry in entries)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._total = total
+        logging.info(f"🧹 图片缓存淘汰 {removed} 个文件，当前 {total / 1024 / 1024:.1f} MB")
+
+    def stats(self) -> Dict:
+        """命中统计"""
+        return {'hits': self.hits, 'misses': self.misses, 'bytes': self._total}
+
+class CoverSourceRecord(JsonDataBase):
+    """合集封面来源记录：{合集Id: {图片类型: {'source_id': 项目Id, 'source_tag': 图片标签}}}"""
+
+    def __init__(self):
+        super().__init__('sources', 'cover')
+        self._lock = threading.Lock()
+
+    def has_record(self, target_id: str, image_type: str) -> bool:
+        """该合集的该类型图片是否由本工具设置过"""
+        return image_type in self.data.get(target_id, {})
+
+    def unchanged(self, target_id: str, image_type: str, source_id: str, source_tag: str) -> bool:
+        """合集当前图片是否已经来自同一项目的同一图片标签"""
+        record = self.data.get(target_id, {}).get(image_type)
+        return bool(record) and record == {'source_id': source_id, 'source_tag': source_tag}
+
+    def record(self, target_id: str, image_type: str, source_id: str, source_tag: str):
+        """上传成功后记录来源并保存"""
+        with self._lock:
+            self.data.setdefault(target_id, {})[image_type] = {'source_id': source_id, 'source_tag': source_tag}
+            self.save()
+
+    def forget(self, target_id: str, image_type: str):
+        """合集图片已丢失时删除记录"""
+        with self._lock:
+            if self.data.get(target_id, {}).pop(image_type, None) is not None:
+                self.save()
+
+_shared_cache: Optional[ImageCache] = None
+_shared_lock = threading.Lock()
+
+def get_image_cache_from_config(config: ConfigParser) -> Optional[ImageCache]:
+    """按config.conf的[ImageCache]部分获取共享的图片缓存，未启用时返回None"""
+    global _shared_cache
+    if not config.getboolean('ImageCache', 'enabled', fallback=True):
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = ImageCache(
+                cache_dir=config.get('ImageCache', 'cache_dir', fallback='./image_cache'),
+                max_bytes=config.getint('ImageCache', 'max_size_mb', fallback=512) * 1024 * 1024
+            )
+        return _shared_cache
+
+_shared_record: Optional[CoverSourceRecord] = None
+
+def get_cover_sources_from_config(config: ConfigParser) -> Optional[CoverSourceRecord]:
+    """按config.conf的[ImageCache] skip_unchanged_covers 获取共享的封面来源记录，未启用时返回None"""
+    global _shared_record
+    if not config.getboolean('ImageCache', 'skip_unchanged_covers', fallback=True):
+        return None
+    with _shared_lock:
+        if _shared_record is None:
+            _shared_record = CoverSourceRecord()
+        return _shared_record
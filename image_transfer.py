@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+封面图片传输选项
+按图片类型向Emby请求服务端缩放后的图片（maxWidth/maxHeight/quality），不再下载多MB的原图；
+可选在进程池中用Pillow重新压缩后再上传（未安装Pillow时跳过）
+"""
+import io
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from configparser import ConfigParser
+from typing import Dict, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# 各图片类型的默认目标尺寸（最大宽, 最大高）
+DEFAULT_IMAGE_SIZES = {
+    'Primary': (1000, 1500),
+    'Backdrop': (1920, 1080),
+    'Thumb': (960, 540),
+    'Logo': (800, 310)
+}
+
+def parse_image_sizes(text: str) -> Dict[str, Tuple[int, int]]:
+    """解析 "Primary=1000x1500,Backdrop=1920x1080" 格式的目标尺寸，未配置的类型使用默认值"""
+    sizes = dict(DEFAULT_IMAGE_SIZES)
+    for entry in (text or '').split(','):
+        if '=' not in entry:
+            continue
+        image_type, size = entry.split('=', 1)
+        try:
+            width, height = (int(value) for value in size.lower().split('x'))
+        except ValueError:
+            logging.warning(f"⚠️ 图片尺寸配置无效: {entry.strip()}")
+            continue
+        sizes[image_type.strip()] = (width, height)
+    return sizes
+
+def recompress_image(image_content: bytes, max_size: Tuple[int, int], quality: int) -> bytes:
+    """缩放到目标尺寸以内并重新编码为JPEG（在子进程中运行）；结果没有变小时返回原图"""
+    with Image.open(io.BytesIO(image_content)) as image:
+        image.thumbnail(max_size)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+    result = output.getvalue()
+    return result if len(result) < len(image_content) else image_content
+
+class ImageTransfer:
+    """封面传输选项：服务端缩放参数和可选的本地重新压缩"""
+
+    def __init__(self, sizes: Dict[str, Tuple[int, int]] = None, quality: int = 85,
+                 resize: bool = True, recompress: bool = False, workers: int = 2, streaming: bool = True):
+        self.sizes = sizes or dict(DEFAULT_IMAGE_SIZES)
+        self.quality = quality
+        self.resize = resize
+        self.recompress = recompress and Image is not None
+        self.workers = max(1, workers)
+        # 不需要本地重新压缩时，边下载边编码上传（不在内存中保留完整图片）
+        self.streaming = streaming
+        self._pool = None
+        self._lock = threading.Lock()
+        if recompress and Image is None:
+            logging.warning("⚠️ 未安装Pillow，跳过图片重新压缩")
+
+    def image_params(self, image_type: str) -> Dict:
+        """请求Emby图片接口时附加的缩放参数（未开启缩放或类型未配置尺寸时为空）"""
+        size = self.sizes.get(image_type)
+        if not self.resize or not size:
+            return {}
+        return {'maxWidth': size[0], 'maxHeight': size[1], 'quality': self.quality}
+
+    def will_recompress(self, image_type: str) -> bool:
+        """该类型图片上传前是否需要本地重新压缩（需要完整图片）"""
+        return self.recompress and image_type in self.sizes
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def prepare(self, image_content: bytes, image_type: str) -> bytes:
+        """上传前处理图片：开启重新压缩时交给进程池，失败时使用原图"""
+        if not self.will_recompress(image_type):
+            return image_content
+        size = self.sizes[image_type]
+        try:
+            result = self._get_pool().submit(recompress_image, image_content, size, self.quality).result()
+        except Exception as e:
+            logging.warning(f"⚠️ 图片重新压缩失败，使用原图: {str(e)}")
+            return image_content
+        if len(result) < len(image_content):
+            logging.info(f"🗜️ 重新压缩 {image_type} 图片: {len(image_content)} -> {len(result)} 字节")
+        return result
+
+    def shutdown(self):
+        """关闭重新压缩进程池"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+_shared_transfer: Optional[ImageTransfer] = None
+_shared_lock = threading.Lock()
+
+def get_image_transfer_from_config(config: ConfigParser) -> ImageTransfer:
+    """按config.conf的[ImageTransfer]部分获取共享的传输选项（各导入器共用一个重新压缩进程池）"""
+    global _shared_transfer
+    with _shared_lock:
+        if _shared_transfer is None:
+            _shared_transfer = ImageTransfer(
+                sizes=parse_image_sizes(config.get('ImageTransfer', 'image_sizes', fallback='')),
+                quality=config.getint('ImageTransfer', 'quality', fallback=85),
+                resize=config.getboolean('ImageTransfer', 'resize', fallback=True),
+                recompress=config.getboolean('ImageTransfer', 'recompress', fallback=False),
+                workers=config.getint('ImageTransfer', 'recompress_workers', fallback=2),
+                streaming=config.getboolean('ImageTransfer', 'streaming_upload', fallback=True)
+            )
+        return _shared_transfer
@@ -12,14 +12,16 @@ import csv
 from configparser import ConfigParser
 from typing import List, Dict, Any
 import time
-import schedule
-from datetime import datetime
-from croniter import croniter
 import requests
+import queue
 import threading
-import fcntl
-import tempfile
 import pytz
+from writeback_buffer import get_write_buffer
+from sharding import run_sharded
+from cron_scheduler import CronScheduler, MISFIRE_RUN_ONCE
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from utils import EmbyAPI
+from resources import resources_conflict, ImporterLocks, EMBY_ITEMS, EXCLUSIVE
 
 logging.basicConfig(
     level=logging.INFO,
@@ -30,40 +32,20 @@ logging.basicConfig(
     ]
 )
 
-class TaskLock:
-    """任务锁，防止多个进程同时运行"""
-    def __init__(self, lock_file='/tmp/emby_importer.lock'):
-        self.lock_file = lock_file
-        self.lock_fd = None
-    
-    def acquire(self):
-        """获取锁"""
-        try:
-            self.lock_fd = open(self.lock_file, 'w')
-            fcntl.flock(self.lock_fd.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-            logging.info("🔒 成功获取任务锁")
-            return True
-        except (IOError, OSError):
-            logging.warning("⚠️ 任务已在运行中，跳过本次执行")
-            return False
-    
-    def release(self):
-        """释放锁"""
-        if self.lock_fd:
-            try:
-                fcntl.flock(self.lock_fd.fileno(), fcntl.LOCK_UN)
-                self.lock_fd.close()
-                logging.info("🔓 释放任务锁")
-            except:
-                pass
-
 class ImporterController:
     def __init__(self):
         self.config = self._load_config()
         self.importers = self._load_importers()
-        self.task_lock = TaskLock()
         self.schedules = self._load_schedules()
         self.timezone = self._get_timezone()
+        # 各导入器最近一次运行的统计（分片执行时为各分片汇总后的报告）
+        self.reports = {}
+        # 定时任务：同一轮触发的导入器先登记，再作为一批交给后台批次线程
+        self._scheduled = []
+        self._scheduled_batches = queue.Queue()
+        self._batch_runner = None
+        # 所有导入器共用的Emby并发请求上限（代替导入器之间的固定等待）
+        EmbyAPI.set_global_concurrency(self.config.getint('Importers', 'emby_max_concurrency', fallback=0))
     
     def _get_timezone(self):
         """获取时区配置"""
@@ -99,7 +81,8 @@ class ImporterController:
             'doulist': {'module': 'EMBY_Doulist_Importer', 'class': 'Get_Detail', 'enabled': self.config.getboolean('Importers', 'enable_doulist', fallback=False), 'description': '豆列导入器'},
             'season_renamer': {'module': 'EMBY_Season_Renamer', 'class': 'Get_Detail', 'enabled': self.config.getboolean('Importers', 'enable_season_renamer', fallback=False), 'description': '季节重命名器'},
             'country_scraper': {'module': 'EMBY_Country_Scraper', 'class': 'Get_Detail', 'enabled': self.config.getboolean('Importers', 'enable_country_scraper', fallback=False), 'description': '国家标签抓取器'},
-            'genre_mapper': {'module': 'EMBY_Genre_Mapper', 'class': 'Get_Detail', 'enabled': self.config.getboolean('Importers', 'enable_genre_mapper', fallback=False), 'description': '类型标签映射器'}
+            'genre_mapper': {'module': 'EMBY_Genre_Mapper', 'class': 'Get_Detail', 'enabled': self.config.getboolean('Importers', 'enable_genre_mapper', fallback=False), 'description': '类型标签映射器'},
+            'cover_backfill': {'module': 'EMBY_Cover_Backfill', 'class': 'Get_Detail', 'enabled': self.config.getboolean('Importers', 'enable_cover_backfill', fallback=False), 'description': '合集封面补全器'}
         }
         
         for importer_name, importer_config in available_importers.items():
@@ -133,7 +116,8 @@ class ImporterController:
             'doulist': 'Doulist_cron',
             'season_renamer': 'SeasonRenamer_cron',
             'country_scraper': 'CountryScraper_cron',
-            'genre_mapper': 'GenreMapper_cron'
+            'genre_mapper': 'GenreMapper_cron',
+            'cover_backfill': 'CoverBackfill_cron'
         }
         
         for importer_name, cron_key in schedule_mapping.items():
@@ -148,11 +132,15 @@ class ImporterController:
         return schedules
     
     def run_importer(self, importer_name: str) -> bool:
-        """运行指定的导入器"""
+        """运行指定的导入器（持有该导入器及其资源的锁，同一导入器已在运行时跳过）"""
         if importer_name not in self.importers:
             logging.error(f"❌ 导入器不存在: {importer_name}")
             return False
         
+        locks = ImporterLocks(importer_name, self._importer_resources(importer_name))
+        if not locks.acquire():
+            return False
+        
         try:
             logging.info(f"🚀 开始运行导入器: {importer_name}")
             logging.info(f"📋 导入器描述: {self.importers[importer_name]['description']}")
@@ -161,17 +149,47 @@ class ImporterController:
             start_time = time.time()
             importer_class = self.importers[importer_name]['class']
             importer_instance = importer_class()
-            importer_instance.run()
+            
+            # 分片执行：支持分片的处理器把大库按 StartIndex 范围拆给多个进程
+            shards = self._plan_shards(importer_name, importer_instance)
+            if shards:
+                self.reports[importer_name] = run_sharded(
+                    importer_class, shards,
+                    workers=self.config.getint('Sharding', 'shard_workers', fallback=1),
+                    requests_per_second=self.config.getfloat('Sharding', 'emby_requests_per_second', fallback=0)
+                )
+            else:
+                self.reports[importer_name] = importer_instance.run()
             
             end_time = time.time()
             duration = end_time - start_time
+            if isinstance(self.reports[importer_name], dict):
+                self.reports[importer_name]['duration_seconds'] = round(duration, 2)
             
             logging.info("=" * 60)
             logging.info(f"✅ 导入器运行完成: {importer_name} (耗时: {duration:.2f}秒)")
+            if isinstance(self.reports[importer_name], dict):
+                logging.info(f"📊 {importer_name} 运行报告: {self.reports[importer_name]}")
             return True
         except Exception as e:
             logging.error(f"❌ 导入器运行失败 {importer_name}: {str(e)}")
             return False
+        finally:
+            locks.release()
+    
+    def _plan_shards(self, importer_name: str, importer_instance) -> List[Dict]:
+        """规划分片；未开启分片、处理器不支持或库较小时返回空列表（按普通方式运行）"""
+        shard_workers = self.config.getint('Sharding', 'shard_workers', fallback=1)
+        if shard_workers <= 1 or not hasattr(importer_instance, 'plan_shards'):
+            return []
+        
+        shards = importer_instance.plan_shards(
+            shard_workers, self.config.getint('Sharding', 'min_shard_size', fallback=2000)
+        )
+        if len(shards) <= 1:
+            return []
+        logging.info(f"🧩 {importer_name} 拆分为 {len(shards)} 个分片")
+        return shards
     
     def _check_emby_status(self) -> bool:
         """检查 Emby 服务器状态"""
@@ -209,10 +227,70 @@ class ImporterController:
         except Exception as e:
             logging.error(f"❌ 初始化CSV文件失败: {str(e)}")
 
-    def run_all_importers(self) -> Dict[str, bool]:
-        """顺序运行所有启用的导入器"""
+    def _importer_resources(self, importer_name: str):
+        """导入器声明的资源（类属性 RESOURCES），未声明时为None（不与其他导入器同时运行）"""
+        return getattr(self.importers[importer_name]['class'], 'RESOURCES', None)
+    
+    def _run_importers(self, importer_names: List[str], max_parallel: int) -> Dict[str, bool]:
+        """按资源声明运行导入器：与正在运行的导入器没有资源冲突时立即启动，否则等待
+        
+        max_parallel 为 1 时按顺序逐个运行；对Emby的总压力由全局并发上限和请求速率控制
+        """
         results = {}
-        logging.info("🚀 开始顺序运行所有导入器")
+        pending = list(importer_names)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            while pending or running:
+                for importer_name in list(pending):
+                    if len(running) >= max_parallel:
+                        break
+                    resources = self._importer_resources(importer_name)
+                    if any(resources_conflict(resources, self._importer_resources(name)) for name in running.values()):
+                        continue
+                    pending.remove(importer_name)
+                    logging.info(f"🔄 准备运行导入器: {importer_name}")
+                    running[executor.submit(self.run_importer, importer_name)] = importer_name
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    importer_name = running.pop(future)
+                    results[importer_name] = future.result()
+                    if results[importer_name]:
+                        logging.info(f"✅ 导入器 {importer_name} 成功完成")
+                    else:
+                        logging.error(f"❌ 导入器 {importer_name} 运行失败")
+        
+        return {name: results[name] for name in importer_names}
+    
+    def _run_batch(self, importer_names: List[str]) -> Dict[str, bool]:
+        """运行一批导入器：按 max_parallel_importers 限制并行数，整批运行期间暂缓写回缓冲区"""
+        max_parallel = max(1, self.config.getint('Importers', 'max_parallel_importers', fallback=1))
+        
+        # 暂缓写回：国家标签、类型映射、季节重命名对同一项目的修改合并到最后一次写回
+        write_buffer = get_write_buffer(
+            max_workers=self.config.getint('WriteBack', 'max_concurrency', fallback=4),
+            requests_per_second=self.config.getfloat('WriteBack', 'requests_per_second', fallback=0)
+        )
+        write_buffer.hold()
+        
+        try:
+            return self._run_importers(importer_names, max_parallel)
+        finally:
+            # 各导入器的锁此时已释放，刷新期间重新持有项目元数据的独占锁，避免与其他进程的扫描或写回重叠
+            locks = ImporterLocks('writeback', {EMBY_ITEMS: EXCLUSIVE})
+            locks.acquire(wait=True)
+            try:
+                write_buffer.release()
+            finally:
+                locks.release()
+    
+    def run_all_importers(self) -> Dict[str, bool]:
+        """运行所有启用的导入器（资源不冲突的导入器可并行运行）"""
+        max_parallel = max(1, self.config.getint('Importers', 'max_parallel_importers', fallback=1))
+        if max_parallel > 1:
+            logging.info(f"🚀 开始运行所有导入器（最多同时运行 {max_parallel} 个）")
+        else:
+            logging.info("🚀 开始顺序运行所有导入器")
         
         # 先检查 Emby 服务器状态
         if not self._check_emby_status():
@@ -222,21 +300,7 @@ class ImporterController:
         # 在开始运行所有导入器之前，清空CSV文件
         self._init_csv_file()
         
-        # 按顺序运行导入器
-        for importer_name in self.importers.keys():
-            logging.info(f"🔄 准备运行导入器: {importer_name}")
-            result = self.run_importer(importer_name)
-            results[importer_name] = result
-            
-            if result:
-                logging.info(f"✅ 导入器 {importer_name} 成功完成")
-            else:
-                logging.error(f"❌ 导入器 {importer_name} 运行失败")
-            
-            # 在导入器之间添加短暂延迟，避免对Emby服务器造成过大压力
-            if list(self.importers.keys()).index(importer_name) < len(self.importers) - 1:
-                logging.info("⏳ 等待5秒后运行下一个导入器...")
-                time.sleep(5)
+        results = self._run_batch(list(self.importers.keys()))
         
         # 统计结果
         success_count = sum(results.values())
@@ -256,47 +320,42 @@ class ImporterController:
         
         return results
     
-    def run_scheduled_task(self):
-        """定时任务执行函数（所有导入器）"""
-        logging.info("⏰ 开始执行定时任务")
-        
-        # 尝试获取任务锁
-        if not self.task_lock.acquire():
-            logging.warning("⚠️ 检测到任务已在运行，跳过本次定时任务")
-            return
-        
-        try:
-            self.run_all_importers()
-        except Exception as e:
-            logging.error(f"❌ 执行任务时发生错误: {str(e)}")
-        finally:
-            # 确保释放锁
-            self.task_lock.release()
-        
-        logging.info("⏰ 定时任务执行完成")
+    def queue_scheduled_importer(self, importer_name: str):
+        """定时任务触发：登记导入器，同一时刻触发的导入器由 dispatch_scheduled 作为一批提交"""
+        if importer_name not in self._scheduled:
+            self._scheduled.append(importer_name)
     
-    def run_single_importer_task(self, importer_name: str):
-        """运行单个导入器的定时任务"""
-        logging.info(f"⏰ 开始执行 {importer_name} 定时任务")
-        
-        # 尝试获取任务锁
-        if not self.task_lock.acquire():
-            logging.warning(f"⚠️ 检测到任务已在运行，跳过 {importer_name} 定时任务")
+    def dispatch_scheduled(self):
+        """把本轮触发的导入器作为一批交给后台批次线程（调度器运行完到期任务后调用，不阻塞调度）"""
+        if not self._scheduled:
             return
+        batch, self._scheduled = self._scheduled, []
+        self._scheduled_batches.put(batch)
+        if self._batch_runner is None:
+            self._batch_runner = threading.Thread(target=self._run_scheduled_batches,
+                                                  name="scheduled-importers", daemon=True)
+            self._batch_runner.start()
+    
+    def _run_scheduled_batches(self):
+        """后台批次线程：逐批运行定时任务，上一批运行期间触发的批次合并为一批"""
+        while True:
+            batch = self._scheduled_batches.get()
+            while not self._scheduled_batches.empty():
+                for importer_name in self._scheduled_batches.get_nowait():
+                    if importer_name not in batch:
+                        batch.append(importer_name)
+            self.run_scheduled_batch(batch)
+    
+    def run_scheduled_batch(self, importer_names: List[str]):
+        """运行一批定时任务（与全量运行相同的并行上限和写回暂缓，同一导入器已在运行时跳过）"""
+        logging.info(f"⏰ 开始执行定时任务: {', '.join(importer_names)}")
         
         try:
-            success = self.run_importer(importer_name)
-            if success:
-                logging.info(f"✅ {importer_name} 定时任务执行完成")
-            else:
-                logging.error(f"❌ {importer_name} 定时任务执行失败")
+            results = self._run_batch(importer_names)
+            success_count = sum(results.values())
+            logging.info(f"⏰ 定时任务执行完成: {success_count}/{len(results)} 成功")
         except Exception as e:
-            logging.error(f"❌ {importer_name} 执行任务时发生错误: {str(e)}")
-        finally:
-            # 确保释放锁
-            self.task_lock.release()
-        
-        logging.info(f"⏰ {importer_name} 定时任务执行完成")
+            logging.error(f"❌ 执行定时任务时发生错误: {str(e)}")
 
 def main():
     """主函数"""
@@ -324,67 +383,29 @@ def main():
         # 进入守护模式
         logging.info("🔄 进入守护模式，等待下次定时执行...")
         
-        # 为每个导入器设置单独的调度
+        # 为每个导入器设置单独的调度（最小堆按下次触发时间排序，主循环只睡到最早的触发时间）
+        scheduler = CronScheduler(
+            controller.timezone,
+            misfire_policy=controller.config.get('Schedule', 'misfire_policy', fallback=MISFIRE_RUN_ONCE).strip(),
+            misfire_grace_seconds=controller.config.getint('Schedule', 'misfire_grace_seconds', fallback=300),
+            after_pending=controller.dispatch_scheduled
+        )
         for importer_name, cron_expression in controller.schedules.items():
             if importer_name in controller.importers and cron_expression:
                 try:
-                    # 检查cron表达式是否为空
-                    if not cron_expression or cron_expression.strip() == '':
-                        logging.warning(f"⚠️ {importer_name} 未配置cron表达式，跳过调度")
-                        continue
-                    
-                    # 获取当前UTC时间，然后转换为目标时区
-                    now_utc = datetime.utcnow()
-                    now = controller.timezone.fromutc(now_utc)
-                    
-                    # 解析cron表达式（使用UTC时间）
-                    cron = croniter(cron_expression, now_utc)
-                    next_run_utc = cron.get_next(datetime)
-                    
-                    # 转换为目标时区
-                    next_run = controller.timezone.fromutc(next_run_utc)
-                    
+                    next_run = scheduler.add_job(importer_name, cron_expression,
+                                                 controller.queue_scheduled_importer, importer_name)
                     logging.info(f"⏰ {importer_name} 调度: {cron_expression}")
                     logging.info(f"⏰ {importer_name} 时区: {controller.timezone}")
                     logging.info(f"⏰ {importer_name} 下次运行时间: {next_run.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-                    
-                    # 设置定时任务
-                    # 根据cron表达式设置不同的调度
-                    if cron_expression.startswith('0 */'):
-                        # 每小时执行
-                        hour_interval = int(cron_expression.split()[1].replace('*/', ''))
-                        schedule.every(hour_interval).hours.do(
-                            controller.run_single_importer_task, importer_name
-                        )
-                        logging.info(f"⏰ {importer_name} 设置为每{hour_interval}小时执行一次")
-                    elif cron_expression.startswith('0 0 */'):
-                        # 每天执行
-                        day_interval = int(cron_expression.split()[2].replace('*/', ''))
-                        schedule.every(day_interval).days.do(
-                            controller.run_single_importer_task, importer_name
-                        )
-                        logging.info(f"⏰ {importer_name} 设置为每{day_interval}天执行一次")
-                    else:
-                        # 默认每天执行
-                        schedule.every().day.at(next_run.strftime("%H:%M")).do(
-                            controller.run_single_importer_task, importer_name
-                        )
-                        logging.info(f"⏰ {importer_name} 设置为每天{next_run.strftime('%H:%M')}执行")
-                    
-                except Exception as e:
+                except ValueError as e:
                     logging.error(f"❌ {importer_name} cron表达式解析失败: {str(e)}")
         
         # 主循环
-        while True:
-            try:
-                schedule.run_pending()
-                time.sleep(30)  # 每30秒检查一次
-            except KeyboardInterrupt:
-                logging.info("🛑 收到退出信号，程序退出")
-                break
-            except Exception as e:
-                logging.error(f"❌ 运行出错: {str(e)}")
-                time.sleep(60)  # 出错后等待1分钟再继续
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            logging.info("🛑 收到退出信号，程序退出")
     else:
         logging.info("🚀 执行单次任务")
         controller.run_all_importers()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+导入器资源声明和资源锁
+每个导入器用类属性 RESOURCES 声明运行时使用的资源及方式（共享/独占），
+主控制器据此判断哪些导入器可以同时运行：同一资源上只要有一方独占就不能同时运行。
+跨进程（如定时任务与手动运行）用文件锁保证同样的规则：每个导入器一把独占锁，每个资源一把共享/独占锁
+"""
+import os
+import fcntl
+import logging
+import tempfile
+from typing import Dict, List, Optional
+
+# 资源使用方式
+SHARED = 'shared'          # 可与其他共享方同时使用（只读，或修改互不重叠的数据）
+EXCLUSIVE = 'exclusive'    # 运行期间独占
+
+# 资源名称
+EMBY_COLLECTIONS = 'emby_collections'  # 合集（创建合集、添加成员）
+EMBY_ITEMS = 'emby_items'              # 项目元数据（标签、类型、名称，经写回缓冲区回传整个项目，写入方需独占）
+EMBY_IMAGES = 'emby_images'            # 合集封面图片
+TMDB = 'tmdb'                          # TMDB客户端和缓存（各处理器共用一个实例）
+RSSHUB = 'rsshub'                      # RSSHub
+
+ALL_RESOURCES = (EMBY_COLLECTIONS, EMBY_ITEMS, EMBY_IMAGES, TMDB, RSSHUB)
+
+# 文件锁目录
+LOCK_DIR = os.path.join(tempfile.gettempdir(), 'emby_importer_locks')
+
+def resources_conflict(first: Optional[Dict[str, str]], second: Optional[Dict[str, str]]) -> bool:
+    """两组资源声明是否冲突；未声明资源（None）的导入器与任何导入器都冲突"""
+    if first is None or second is None:
+        return True
+    for name in set(first) & set(second):
+        if EXCLUSIVE in (first[name], second[name]):
+            return True
+    return False
+
+class ImporterLocks:
+    """一个导入器运行所需的文件锁
+
+    - 导入器自身的独占锁：同一导入器已在运行（本进程或其他进程）时跳过本次运行
+    - 各资源的共享/独占锁：按资源名称排序依次获取（顺序固定，不会死锁），有冲突时等待
+    未声明资源的导入器独占所有资源
+    """
+
+    def __init__(self, importer_name: str, resources: Optional[Dict[str, str]], lock_dir: str = LOCK_DIR):
+        self.importer_name = importer_name
+        if resources is None:
+            resources = {name: EXCLUSIVE for name in ALL_RESOURCES}
+        self.resources = resources
+        self.lock_dir = lock_dir
+        self._fds: List = []
+
+    def _lock(self, name: str, mode: str, blocking: bool) -> bool:
+        lock_file = open(os.path.join(self.lock_dir, f'{name}.lock'), 'w')
+        flags = fcntl.LOCK_EX if mode == EXCLUSIVE else fcntl.LOCK_SH
+        try:
+            fcntl.flock(lock_file.fileno(), flags | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            if not blocking:
+                lock_file.close()
+                return False
+            logging.info(f"⏳ {self.importer_name} 等待资源锁: {name}")
+            fcntl.flock(lock_file.fileno(), flags)
+        self._fds.append(lock_file)
+        return True
+
+    def acquire(self, wait: bool = False) -> bool:
+        """获取所有锁；导入器已在运行时返回False（不等待），wait=True 时等待其结束"""
+        os.makedirs(self.lock_dir, exist_ok=True)
+        if not self._lock(f'importer_{self.importer_name}', EXCLUSIVE, blocking=wait):
+            logging.warning(f"⚠️ {self.importer_name} 任务已在运行中，跳过本次执行")
+            return False
+        for name in sorted(self.resources):
+            self._lock(f'resource_{name}', self.resources[name], blocking=True)
+        logging.info(f"🔒 {self.importer_name} 获取锁: {', '.join(sorted(self.resources)) or '无资源'}")
+        return True
+
+    def release(self):
+        """按获取的相反顺序释放所有锁"""
+        while self._fds:
+            lock_file = self._fds.pop()
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                lock_file.close()
+            except (IOError, OSError):
+                pass
+        logging.info(f"🔓 {self.importer_name} 释放锁")
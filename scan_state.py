@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+扫描器增量状态
+记录每个库的高水位（最新保存/创建时间）、库指纹和每个项目的指纹，
+让国家标签抓取器、类型标签映射器、季节重命名器只处理新增或变化的项目。
+处理过程中只暂存状态，写回缓冲区实际写回后才保存（预览模式不保存，写回失败的项目下次重新处理）
+"""
+import json
+import hashlib
+import logging
+from typing import AbstractSet, Dict, Iterable
+from datetime import date, timedelta
+from utils import JsonDataBase, EmbyAPI
+
+# 增量模式下列表查询需要的字段（用于计算项目指纹）
+FINGERPRINT_FIELDS = 'ProviderIds,Tags,Genres,DateLastSaved,DateCreated'
+
+def item_fingerprint(item: Dict) -> str:
+    """计算项目指纹（ProviderIds、Tags、Genres、DateLastSaved）"""
+    payload = json.dumps([
+        item.get('ProviderIds', {}),
+        sorted(item.get('Tags') or [tag.get('Name') for tag in item.get('TagItems', [])]),
+        sorted(item.get('Genres') or []),
+        item.get('DateLastSaved')
+    ], sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+class IncrementalScanState(JsonDataBase):
+    """增量扫描状态（每个扫描器一个状态文件）"""
+
+    def __init__(self, scanner_name: str, full_scan_interval_days: int = 7):
+        super().__init__(scanner_name, 'scan_state')
+        self.full_scan_interval_days = full_scan_interval_days
+        self._pending = None
+        # 暂存的状态：{库Id: {'items': {项目Id: 指纹}, 'library': (库指纹, 是否全量扫描) 或 None}}
+        self._staged = {}
+
+    def _library(self, library_id: str) -> Dict:
+        return self.data.setdefault(library_id, {'items': {}})
+
+    def needs_full_scan(self, library_id: str) -> bool:
+        """首次运行或距离上次全量扫描超过间隔时需要全量扫描"""
+        last_full_scan = self._library(library_id).get('last_full_scan')
+        if not last_full_scan:
+            return True
+        return date.fromisoformat(last_full_scan) + timedelta(days=self.full_scan_interval_days) <= date.today()
+
+    def collect_items(self, emby_api: EmbyAPI, library_id: str, item_types: str,
+                      fields: str = FINGERPRINT_FIELDS) -> Iterable[Dict]:
+        """获取需要处理的项目
+
+        - 库指纹（数量 + 最新保存/创建时间）未变化时直接返回空列表，不再列出项目
+        - 需要全量扫描时流式列出全部项目（分页拉取，不在内存中保留整个库）
+        - 否则按 MinDateLastSaved / MinDateCreated 只列出高水位之后的项目，并过滤掉指纹未变的项目
+        """
+        library = self._library(library_id)
+        fingerprint = emby_api.get_library_fingerprint(library_id, item_types)
+        full_scan = self.needs_full_scan(library_id)
+        self._pending = (library_id, fingerprint, full_scan)
+
+        base_params = {
+            'ParentId': library_id,
+            'Recursive': 'true',
+            'IncludeItemTypes': item_types,
+            'Fields': fields,
+            'EnableImages': 'false',
+            'EnableUserData': 'false'
+        }
+
+        if full_scan:
+            logging.info("🔁 增量模式：执行定期全量扫描")
+            return emby_api.iter_items(base_params)
+
+        if fingerprint and fingerprint == library.get('fingerprint'):
+            logging.info(f"⏭️ 增量模式：库没有变化（{fingerprint['count']} 个项目），跳过扫描")
+            return []
+
+        items = {}
+        for param, key in [('MinDateLastSaved', 'newest_saved'), ('MinDateCreated', 'newest_created')]:
+            high_water = (library.get('fingerprint') or {}).get(key)
+            if not high_water:
+                continue
+            for item in emby_api.query_items(dict(base_params, **{param: high_water})):
+                items[item['Id']] = item
+
+        changed = [item for item in items.values() if self.item_changed(library_id, item)]
+        logging.info(f"🔎 增量模式：高水位之后有 {len(items)} 个项目，其中 {len(changed)} 个有变化")
+        return changed
+
+    def item_changed(self, library_id: str, item: Dict) -> bool:
+        """项目指纹是否与上次记录不同"""
+        return self._library(library_id)['items'].get(item['Id']) != item_fingerprint(item)
+
+    def _staged_library(self, library_id: str) -> Dict:
+        return self._staged.setdefault(library_id, {'items': {}, 'library': None})
+
+    def record_item(self, library_id: str, item: Dict):
+        """暂存已处理项目的指纹（写回完成后由 commit 保存）"""
+        self._staged_library(library_id)['items'][item['Id']] = item_fingerprint(item)
+
+    def finish(self, library_id: str):
+        """库处理完成：暂存高水位、库指纹和全量扫描日期（写回完成后由 commit 保存）"""
+        if not self._pending or self._pending[0] != library_id:
+            return
+        _, fingerprint, full_scan = self._pending
+        self._staged_library(library_id)['library'] = (fingerprint, full_scan)
+        self._pending = None
+
+    def commit(self, failed_ids: AbstractSet[str] = frozenset()):
+        """写回完成后保存暂存的状态（由写回缓冲区在实际写回后回调）
+
+        写回失败的项目不记录指纹；库中有写回失败的项目时不更新库指纹和全量扫描日期，下次运行时重新处理
+        """
+        for library_id, staged in self._staged.items():
+            library = self._library(library_id)
+            failed = [item_id for item_id in staged['items'] if item_id in failed_ids]
+            for item_id, fingerprint in staged['items'].items():
+                if item_id not in failed_ids:
+                    library['items'][item_id] = fingerprint
+
+            if failed:
+                logging.warning(f"⚠️ 增量模式：{len(failed)} 个项目写回失败，下次运行时重新处理")
+            elif staged['library']:
+                fingerprint, full_scan = staged['library']
+                if fingerprint:
+                    library['fingerprint'] = fingerprint
+                if full_scan:
+                    library['last_full_scan'] = date.today().isoformat()
+        self._staged = {}
+        self.save()
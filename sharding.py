@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大库分片执行
+把库中的项目按 StartIndex 范围拆成若干分片，交给多个进程并行处理（JSON解析和标签/名称比对不再挤在一个核上）；
+每个进程有自己的Emby/TMDB客户端，并分到全局请求速率的一部分，各分片的统计结果汇总为一份报告
+"""
+import logging
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+def split_shards(total: int, workers: int, min_shard_size: int = 2000) -> List[Tuple[int, int]]:
+    """把 total 个项目拆成 (start_index, limit) 分片，每片至少 min_shard_size 个（库较小时减少分片数）"""
+    if total <= 0:
+        return []
+    count = max(1, min(workers, total // max(1, min_shard_size)))
+    size, extra = divmod(total, count)
+    shards = []
+    start = 0
+    for index in range(count):
+        limit = size + (1 if index < extra else 0)
+        shards.append((start, limit))
+        start += limit
+    return shards
+
+def run_shard(module_name: str, class_name: str, shard: Dict, requests_per_second: float) -> Dict:
+    """子进程入口：创建处理器实例（独立的会话和客户端），按分片速率运行并返回统计"""
+    module = importlib.import_module(module_name)
+    importer = getattr(module, class_name)()
+    if requests_per_second:
+        importer.emby_api.set_rate_limit(requests_per_second)
+    tmdb_api = getattr(importer, 'tmdb_api', None)
+    if tmdb_api:
+        tmdb_api.db.enable_shared_writes()
+        # 父进程已根据Changes API淘汰缓存，子进程沿用同一跟踪起点，未变更的条目不再按日期过期
+        if shard.get('tmdb_tracking_since'):
+            tmdb_api.adopt_tracking(shard['tmdb_tracking_since'])
+    return importer.run_shard(shard)
+
+def merge_stats(stats_list: List[Dict]) -> Dict:
+    """汇总各分片的统计（数值相加，字典逐键相加）"""
+    merged = {}
+    for stats in stats_list:
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                merged[key] = merge_stats([merged.get(key, {}), value])
+            elif isinstance(value, (int, float)):
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+def run_sharded(importer_class, shards: List[Dict], workers: int, requests_per_second: float = 0) -> Dict:
+    """用进程池运行所有分片并汇总统计
+
+    子进程使用 spawn 方式启动，不继承父进程的写回缓冲区等状态；
+    全局速率 requests_per_second 按同时运行的进程数平均分配
+    """
+    workers = max(1, min(workers, len(shards)))
+    shard_rate = requests_per_second / workers if requests_per_second else 0
+    logging.info(f"🧩 分片执行: {len(shards)} 个分片，{workers} 个进程"
+                 + (f"，每个进程 {shard_rate:.2f} 次请求/秒" if shard_rate else ""))
+
+    results = []
+    failed = 0
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [
+            (shard, executor.submit(run_shard, importer_class.__module__, importer_class.__name__,
+                                    shard, shard_rate))
+            for shard in shards
+        ]
+        for shard, future in futures:
+            try:
+                results.append(future.result())
+                logging.info(f"✅ 分片完成: {shard['library_name']} "
+                             f"[{shard['start_index']}, {shard['start_index'] + shard['limit']})")
+            except Exception as e:
+                failed += 1
+                logging.error(f"❌ 分片失败: {shard['library_name']} "
+                              f"[{shard['start_index']}, {shard['start_index'] + shard['limit']}): {str(e)}")
+
+    report = merge_stats(results)
+    report['shards'] = len(shards)
+    report['failed_shards'] = failed
+    logging.info(f"📊 分片汇总报告: {report}")
+    return report
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TMDB API 统一工具模块
+季节重命名器和国家标签抓取器共用同一个TMDB客户端和缓存，
+每个条目只请求一次TMDB（append_to_response），缓存中保存所有扫描器需要的字段
+"""
+import os
+import time
+import fcntl
+import logging
+import threading
+import requests
+from typing import Dict, Optional, Set, Tuple
+from datetime import date, timedelta
+from dateutil import parser
+from utils import JsonDataBase
+
+DEFAULT_TMDB_BASE_URL = 'https://api.themoviedb.org/3'
+
+# TMDB Changes API 单次查询最多覆盖14天
+CHANGES_WINDOW_DAYS = 14
+# 游标落后超过该天数时不再逐窗口追赶，重新开始跟踪
+CHANGES_MAX_CATCHUP_DAYS = 90
+
+def _parse_date(value) -> Optional[date]:
+    """解析TMDB日期字符串，失败时返回None"""
+    if not value:
+        return None
+    try:
+        return parser.parse(value).date()
+    except Exception:
+        return None
+
+class CachePolicy:
+    """TMDB缓存过期策略基类
+
+    ttl_days 返回正常条目的有效天数（None 表示不过期），
+    否定条目（TMDB 404 或缺少国家信息）统一使用 negative_ttl_days。
+    """
+
+    def __init__(self, negative_ttl_days: int = 3):
+        self.negative_ttl_days = negative_ttl_days
+
+    def ttl_days(self, entry: Dict, today: date) -> Optional[int]:
+        raise NotImplementedError
+
+    def is_negative(self, entry: Dict) -> bool:
+        """是否为否定条目"""
+        return bool(entry.get('not_found')) or not entry.get('production_countries')
+
+    def is_expired(self, entry: Dict, today: date) -> bool:
+        ttl = self.negative_ttl_days if self.is_negative(entry) else self.ttl_days(entry, today)
+        if ttl is None:
+            return False
+        update_date = date.fromisoformat(entry['update_date'])
+        return update_date + timedelta(days=ttl) < today
+
+class PremiereDateCachePolicy(CachePolicy):
+    """按首映/最近播出日期分级过期（原有策略）"""
+
+    def ttl_days(self, entry: Dict, today: date) -> Optional[int]:
+        air_date = _parse_date(entry.get('premiere_date')) or today
+        if air_date + timedelta(days=30) > today:
+            return 3
+        elif air_date + timedelta(days=90) > today:
+            return 15
+        return 30
+
+class StatusAwareCachePolicy(CachePolicy):
+    """按TMDB状态过期：完结剧集和老电影长期缓存，连载剧集按下一集播出时间刷新"""
+
+    ENDED_STATUSES = ('Ended', 'Canceled')
+    RELEASED_STATUSES = ('Released',)
+
+    def __init__(self, negative_ttl_days: int = 3, stable_ttl_days: int = 180):
+        super().__init__(negative_ttl_days)
+        self.stable_ttl_days = stable_ttl_days
+
+    def ttl_days(self, entry: Dict, today: date) -> Optional[int]:
+        status = entry.get('status')
+        last_air_date = _parse_date(entry.get('last_air_date') or entry.get('premiere_date'))
+        recently_aired = last_air_date is not None and last_air_date + timedelta(days=90) > today
+
+        if status in self.ENDED_STATUSES or status in self.RELEASED_STATUSES:
+            # 刚完结/刚上映的条目信息仍可能补全，稍后再确认一次
+            return 30 if recently_aired else self.stable_ttl_days
+
+        next_air_date = _parse_date(entry.get('next_episode_air_date'))
+        if next_air_date:
+            # 下一集播出后才会有新数据
+            return max(1, min((next_air_date - today).days + 1, 30))
+
+        if status is None:
+            # 旧缓存条目没有状态信息，按播出日期处理
+            return PremiereDateCachePolicy.ttl_days(self, entry, today)
+
+        # 连载中但暂无下一集排期（季间休息等）
+        return 3 if recently_aired else 15
+
+CACHE_POLICIES = {
+    'premiere': PremiereDateCachePolicy,
+    'status': StatusAwareCachePolicy,
+}
+
+def build_cache_policy(name: str, negative_ttl_days: int = 3) -> CachePolicy:
+    """根据名称创建缓存策略"""
+    policy_class = CACHE_POLICIES.get(name)
+    if not policy_class:
+        logging.warning(f"⚠️ 未知的TMDB缓存策略: {name}，使用 status")
+        policy_class = StatusAwareCachePolicy
+    return policy_class(negative_ttl_days=negative_ttl_days)
+
+class TmdbDataBase(JsonDataBase):
+    """TMDB数据缓存类（季节、别名、国家、语言共用一个条目）"""
+
+    def __init__(self, *args, policy: CachePolicy = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.policy = policy or StatusAwareCachePolicy()
+        # 由Changes API同步成功后开启，开启后跟踪起点之后写入的条目不再按日期过期
+        self.change_tracking = False
+        self.tracking_since = None
+        # 多进程共用缓存文件时（分片执行），保存前先合并磁盘上其他进程写入的条目
+        self.shared_writes = False
+        self._touched = set()
+
+    def enable_shared_writes(self):
+        """开启多进程安全保存：文件锁 + 合并磁盘数据 + 原子替换"""
+        self.shared_writes = True
+
+    def save(self):
+        if not self.shared_writes:
+            return super().save()
+
+        with open(f'{self.file_path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            merged = self.load()
+            for key in self._touched:
+                if key in self.data:
+                    merged[key] = self.data[key]
+                else:
+                    merged.pop(key, None)
+            self._touched.clear()
+            self.data = merged
+
+            tmp_path = f'{self.file_path}.{os.getpid()}.tmp'
+            self.dump(self.data, path=tmp_path)
+            os.replace(tmp_path, self.file_path)
+
+    def __getitem__(self, tmdb_id):
+        data = self.data.get(tmdb_id)
+        if not data:
+            return
+
+        # 否定条目始终按自身的较短有效期过期
+        if (self.change_tracking and not self.policy.is_negative(data)
+                and date.fromisoformat(data['update_date']) >= self.tracking_since):
+            return data
+
+        if self.policy.is_expired(data, date.today()):
+            return
+
+        return data
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self._touched.add(key)
+        self.save()
+
+    def clean_not_trust_data(self, expire_days=7, min_trust=0.5):
+        """清理不可信数据"""
+        today = date.today()
+        keys_to_remove = []
+        for key, value in self.data.items():
+            update_date = date.fromisoformat(value['update_date'])
+            if update_date + timedelta(days=expire_days) < today:
+                keys_to_remove.append(key)
+
+        for key in keys_to_remove:
+            del self.data[key]
+        self._touched.update(keys_to_remove)
+        self.save()
+
+    def evict(self, keys) -> int:
+        """淘汰指定的缓存条目，返回实际淘汰的数量"""
+        removed = [key for key in keys if key in self.data]
+        for key in removed:
+            del self.data[key]
+        self._touched.update(removed)
+        if removed:
+            self.save()
+        return len(removed)
+
+    def save_details(self, tmdb_id, name, resp_json, is_movie=False):
+        """保存TMDB详情（所有扫描器需要的字段的并集）"""
+        if is_movie:
+            premiere_date = resp_json.get('release_date')
+            titles = resp_json.get('alternative_titles', {}).get('titles')
+        else:
+            premiere_date = resp_json.get('last_air_date', resp_json.get('first_air_date'))
+            titles = resp_json.get('alternative_titles', {}).get('results')
+
+        next_episode = resp_json.get('next_episode_to_air') or {}
+
+        self.data[tmdb_id] = {
+            'premiere_date': premiere_date,
+            'name': name,
+            'alt_names': titles,
+            'seasons': resp_json.get('seasons'),
+            'production_countries': resp_json.get('production_countries', []),
+            'spoken_languages': resp_json.get('spoken_languages', []),
+            'status': resp_json.get('status'),
+            'last_air_date': resp_json.get('last_air_date', resp_json.get('release_date')),
+            'next_episode_air_date': next_episode.get('air_date'),
+            'update_date': date.today().isoformat()
+        }
+        self._touched.add(tmdb_id)
+        self.save()
+        return self.data[tmdb_id]
+
+    def save_not_found(self, tmdb_id, name):
+        """保存否定条目（TMDB返回404）"""
+        self.data[tmdb_id] = {
+            'name': name,
+            'not_found': True,
+            'update_date': date.today().isoformat()
+        }
+        self._touched.add(tmdb_id)
+        self.save()
+
+class TMDBAPI:
+    """TMDB API接口类"""
+
+    def __init__(self, api_key: str, base_url: str = DEFAULT_TMDB_BASE_URL, cache_name: str = 'tmdb_cache',
+                 cache_policy: CachePolicy = None):
+        self.api_key = api_key
+        self.base_url = (base_url or DEFAULT_TMDB_BASE_URL).rstrip('/')
+        self.db = TmdbDataBase(cache_name, policy=cache_policy)
+        self.sync_state = JsonDataBase(cache_name, 'sync')
+        self._last_sync_time = None
+
+        # 检查API密钥
+        if not self.api_key:
+            logging.error("❌ TMDB API密钥未设置！请在config.conf的[TMDB]部分设置tmdb_api_key")
+            return
+
+        # 检查API密钥格式
+        if not self.api_key.startswith('eyJ') and len(self.api_key) < 100:
+            logging.warning("⚠️ TMDB API密钥格式可能不正确，应该是Bearer Token格式（以eyJ开头的长字符串）")
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "accept": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        })
+
+        logging.info(f"🔑 TMDB API密钥已配置: {self.api_key[:20]}...")
+        logging.info(f"🌐 TMDB API基础URL: {self.base_url}")
+
+    def _get(self, path: str, params: Dict = None) -> Optional[Dict]:
+        """发送TMDB GET请求"""
+        return self._request(path, params)[1]
+
+    def _request(self, path: str, params: Dict = None) -> Tuple[Optional[int], Optional[Dict]]:
+        """发送TMDB GET请求，返回 (状态码, JSON数据)"""
+        if not self.api_key:
+            logging.error("❌ TMDB API密钥未设置，无法请求TMDB API")
+            return None, None
+
+        try:
+            url = f"{self.base_url}{path}"
+            logging.info(f"🔗 TMDB API请求URL: {url}")
+
+            response = self.session.get(url, params=params, timeout=30)
+
+            logging.info(f"📊 TMDB响应状态码: {response.status_code}")
+            if response.status_code != 200:
+                logging.error(f"❌ TMDB API请求失败: {response.status_code}")
+                logging.error(f"🔍 TMDB错误响应: {response.text[:500]}")
+                return response.status_code, None
+
+            return response.status_code, response.json()
+
+        except Exception as e:
+            logging.error(f"❌ 获取TMDB数据失败: {str(e)}")
+            return None, None
+
+    def _details_path(self, tmdb_id: str, is_movie: bool) -> str:
+        media_type = 'movie' if is_movie else 'tv'
+        return f"/{media_type}/{tmdb_id}?language=zh-CN&append_to_response=alternative_titles"
+
+    def get_movie_info(self, tmdb_id: str) -> Optional[Dict]:
+        """获取电影信息"""
+        return self._get(self._details_path(tmdb_id, True))
+
+    def get_tv_series_info(self, tmdb_id: str) -> Optional[Dict]:
+        """获取电视剧信息"""
+        return self._get(self._details_path(tmdb_id, False))
+
+    def get_cached_info(self, tmdb_id: str, is_movie: bool = False) -> Optional[Dict]:
+        """只从缓存获取TMDB条目（不请求网络），未命中或为否定条目时返回None"""
+        cache_data = self.db[('mv' if is_movie else 'tv') + f'{tmdb_id}']
+        if not cache_data or cache_data.get('not_found'):
+            return None
+        return cache_data
+
+    def get_cache_entry(self, tmdb_id: str, is_movie: bool = False) -> Optional[Dict]:
+        """只从缓存获取TMDB条目（包括否定条目），未命中或已过期时返回None"""
+        return self.db[('mv' if is_movie else 'tv') + f'{tmdb_id}']
+
+    def get_item_info(self, tmdb_id: str, name: str, is_movie: bool = False) -> Tuple[Optional[Dict], Optional[bool]]:
+        """获取TMDB条目信息，优先使用缓存
+
+        Returns:
+            tuple: (缓存条目, 是否来自缓存)，获取失败时为 (None, None)
+        """
+        cache_key = ('mv' if is_movie else 'tv') + f'{tmdb_id}'
+        cache_data = self.db[cache_key]
+        if cache_data:
+            if cache_data.get('not_found'):
+                logging.debug(f"⏭️ TMDB否定缓存命中: {cache_key} {name}")
+                return None, True
+            return cache_data, True
+
+        status_code, resp_json = self._request(self._details_path(tmdb_id, is_movie))
+        if status_code == 404:
+            self.db.save_not_found(cache_key, name)
+            return None, False
+        if not resp_json:
+            return None, None
+
+        return self.db.save_details(cache_key, name, resp_json, is_movie=is_movie), False
+
+    def get_changed_ids(self, media_type: str, start_date: date, end_date: date) -> Optional[Set[int]]:
+        """获取时间窗口内发生变更的TMDB ID（media_type 为 movie 或 tv）"""
+        changed_ids = set()
+        page = 1
+        while True:
+            data = self._get(f"/{media_type}/changes", params={
+                'start_date': start_date.isoformat(),
+                'end_date': end_date.isoformat(),
+                'page': page
+            })
+            if data is None:
+                return None
+
+            changed_ids.update(item['id'] for item in data.get('results', []) if 'id' in item)
+            if page >= data.get('total_pages', 1):
+                return changed_ids
+            page += 1
+
+    def sync_changes(self, min_interval: int = 3600) -> bool:
+        """根据TMDB Changes API淘汰发生变更的缓存条目
+
+        从上次同步的游标开始，按14天一个窗口查询 /movie/changes 和 /tv/changes，
+        只淘汰出现在变更列表中且已缓存的条目。同步成功后未变更的条目不再按日期过期。
+
+        Returns:
+            bool: 同步是否成功（失败时缓存继续按日期过期）
+        """
+        if self._last_sync_time and time.time() - self._last_sync_time < min_interval:
+            return self.db.change_tracking
+
+        today = date.today()
+        cursor = self.sync_state.data.get('last_sync')
+
+        if not cursor or (today - date.fromisoformat(cursor)).days > CHANGES_MAX_CATCHUP_DAYS:
+            # 无法得知游标之前的变更：从今天开始跟踪，之前写入的条目仍按日期过期
+            logging.info(f"🧭 TMDB变更同步从今天开始跟踪 (上次游标: {cursor or '无'})")
+            self.sync_state.data['tracking_since'] = today.isoformat()
+            self._enable_tracking(today)
+            return True
+
+        start = date.fromisoformat(cursor)
+        movie_ids, tv_ids = set(), set()
+        while start <= today:
+            end = min(start + timedelta(days=CHANGES_WINDOW_DAYS - 1), today)
+            changed_movies = self.get_changed_ids('movie', start, end)
+            changed_tv = self.get_changed_ids('tv', start, end)
+            if changed_movies is None or changed_tv is None:
+                logging.error("❌ TMDB变更同步失败，本次缓存按日期过期")
+                self.db.change_tracking = False
+                return False
+            movie_ids |= changed_movies
+            tv_ids |= changed_tv
+            start = end + timedelta(days=1)
+
+        keys = [f'mv{tmdb_id}' for tmdb_id in movie_ids] + [f'tv{tmdb_id}' for tmdb_id in tv_ids]
+        removed = self.db.evict(keys)
+        logging.info(f"🧭 TMDB变更同步完成: 自 {cursor} 起 {len(movie_ids)} 部电影、{len(tv_ids)} 部剧集有变更，淘汰 {removed} 个缓存条目")
+
+        self._enable_tracking(today)
+        return True
+
+    def tracking_since(self) -> Optional[str]:
+        """当前生效的变更跟踪起点（未开启跟踪时为None），分片执行时传给各子进程"""
+        return self.db.tracking_since.isoformat() if self.db.change_tracking else None
+
+    def adopt_tracking(self, tracking_since: str):
+        """沿用父进程的同步结果（子进程的缓存文件已经淘汰过变更条目）：开启变更跟踪，不再重复同步"""
+        self.db.tracking_since = date.fromisoformat(tracking_since)
+        self.db.change_tracking = True
+        self._last_sync_time = time.time()
+
+    def _enable_tracking(self, cursor: date):
+        """保存同步游标并开启变更跟踪"""
+        self.sync_state.data['last_sync'] = cursor.isoformat()
+        self.sync_state.save()
+        self.db.tracking_since = date.fromisoformat(self.sync_state.data.get('tracking_since', cursor.isoformat()))
+        self.db.change_tracking = True
+        self._last_sync_time = time.time()
+
+_shared_apis = {}
+_shared_lock = threading.Lock()
+
+def get_shared_tmdb_api(api_key: str, base_url: str = DEFAULT_TMDB_BASE_URL,
+                        cache_policy: CachePolicy = None) -> TMDBAPI:
+    """获取进程内共享的TMDB客户端（共用会话和缓存）"""
+    key = (api_key, base_url)
+    with _shared_lock:
+        if key not in _shared_apis:
+            _shared_apis[key] = TMDBAPI(api_key, base_url, cache_policy=cache_policy)
+        return _shared_apis[key]
+
+def get_tmdb_api_from_config(config) -> TMDBAPI:
+    """根据config.conf的[TMDB]部分获取共享的TMDB客户端"""
+    cache_policy = build_cache_policy(
+        config.get('TMDB', 'cache_policy', fallback='status'),
+        negative_ttl_days=config.getint('TMDB', 'negative_ttl_days', fallback=3)
+    )
+    return get_shared_tmdb_api(
+        config.get('TMDB', 'tmdb_api_key', fallback=''),
+        config.get('TMDB', 'tmdb_api_base_url', fallback=DEFAULT_TMDB_BASE_URL),
+        cache_policy=cache_policy
+    )
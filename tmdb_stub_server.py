@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地TMDB替身服务
+用于在不访问真实TMDB的情况下测试缓存淘汰（/movie/changes、/tv/changes）和详情请求
+把 config.conf 中的 tmdb_api_base_url 指向 http://127.0.0.1:8765/3 即可使用
+"""
+import json
+import argparse
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def load_fixture(path):
+    """加载测试数据
+
+    格式：
+    {
+        "changes": {"movie": [550, 603], "tv": [1399]},
+        "movie": {"550": {...TMDB电影详情...}},
+        "tv": {"1399": {...TMDB剧集详情...}}
+    }
+    """
+    if not path:
+        return {'changes': {'movie': [], 'tv': []}, 'movie': {}, 'tv': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+class TmdbStubHandler(BaseHTTPRequestHandler):
+    """TMDB接口替身"""
+
+    fixture = {}
+    page_size = 100
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parsed = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        parts = [part for part in parsed.path.split('/') if part]
+        if parts and parts[0] == '3':
+            parts = parts[1:]
+
+        if len(parts) == 2 and parts[0] in ('movie', 'tv') and parts[1] == 'changes':
+            ids = self.fixture.get('changes', {}).get(parts[0], [])
+            page = int(query.get('page', ['1'])[0])
+            total_pages = max(1, (len(ids) + self.page_size - 1) // self.page_size)
+            chunk = ids[(page - 1) * self.page_size:page * self.page_size]
+            self._send_json(200, {
+                'results': [{'id': tmdb_id, 'adult': False} for tmdb_id in chunk],
+                'page': page,
+                'total_pages': total_pages,
+                'total_results': len(ids)
+            })
+            return
+
+        if len(parts) == 2 and parts[0] in ('movie', 'tv'):
+            details = self.fixture.get(parts[0], {}).get(parts[1])
+            if details is None:
+                self._send_json(404, {'success': False, 'status_code': 34,
+                                      'status_message': 'The resource you requested could not be found.'})
+            else:
+                self._send_json(200, details)
+            return
+
+        self._send_json(404, {'success': False, 'status_message': 'Unknown endpoint'})
+
+def main():
+    parser = argparse.ArgumentParser(description='本地TMDB替身服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    parser.add_argument('--fixture', help='测试数据JSON文件')
+    parser.add_argument('--page-size', type=int, default=100, help='变更列表每页条数')
+    args = parser.parse_args()
+
+    TmdbStubHandler.fixture = load_fixture(args.fixture)
+    TmdbStubHandler.page_size = args.page_size
+
+    server = ThreadingHTTPServer((args.host, args.port), TmdbStubHandler)
+    print(f"🌐 TMDB替身服务已启动: http://{args.host}:{args.port}/3")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("🛑 TMDB替身服务已停止")
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,152 @@ Emby API 和 RSSHub 统一工具模块
 整合所有导入器中的API调用方法
 """
 import os
+import json
 import urllib.parse
 import requests
 import feedparser
 import base64
 import logging
 import time
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+import contextlib
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Iterable, BinaryIO
 from configparser import ConfigParser
 
+class JsonDataBase:
+    """JSON数据库类，用于本地缓存数据"""
+    
+    def __init__(self, name, prefix='', db_type='dict', workdir=None):
+        self.file_name = f'{prefix}_{name}.json' if prefix else f'{name}.json'
+        self.file_path = os.path.join(workdir, self.file_name) if workdir else self.file_name
+        self.db_type = db_type
+        self.data = self.load()
+
+    def load(self, encoding='utf-8'):
+        try:
+            with open(self.file_path, encoding=encoding) as f:
+                _json = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return dict(list=[], dict={})[self.db_type]
+        else:
+            return _json
+
+    def dump(self, obj, encoding='utf-8', path=None):
+        with open(path or self.file_path, 'w', encoding=encoding) as f:
+            json.dump(obj, f, indent=2, ensure_ascii=False)
+
+    def save(self):
+        self.dump(self.data)
+
+class RatePacer:
+    """请求节流：多个线程共用，保证整体请求速率不超过 requests_per_second（0 为不限制）"""
+
+    def __init__(self, requests_per_second: float = 0):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_time, now)
+            self._next_time = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+# 提供标签增删接口（/Items/{Id}/Tags/Add）的最低Emby版本
+TAG_ENDPOINT_MIN_VERSION = (4, 8)
+
+# 按Id批量查询时每次请求的Id数量（控制URL长度）
+IDS_CHUNK_SIZE = 100
+
+# 写回前批量查询时需要的字段：只用来判断登记的修改是否会改变项目（Name默认返回）。
+# 列表视图不含完整元数据，不能直接回传（POST /Items/{Id} 会清空缺少的字段），提交前需逐个获取完整详情
+ITEM_DIFF_FIELDS = 'Genres,LockedFields,Tags'
+
+# 流式上传时每次读取的字节数（3的倍数，分块base64编码后可直接拼接）
+STREAM_CHUNK_SIZE = 3 * 64 * 1024
+
+def base64_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """把字节块流增量编码为base64（不足3字节的尾部留到下一块再编码）"""
+    remainder = b''
+    for chunk in chunks:
+        data = remainder + chunk
+        cut = len(data) - len(data) % 3
+        remainder = data[cut:]
+        if cut:
+            yield base64.b64encode(data[:cut])
+    if remainder:
+        yield base64.b64encode(remainder)
+
+def item_image_tag(item: Dict, image_type: str) -> Optional[str]:
+    """从项目列表/详情中取出某类型图片的标签（背景图取第一张），没有该图片时返回None"""
+    if image_type.lower() == 'backdrop':
+        tags = item.get('BackdropImageTags') or []
+        return tags[0] if tags else None
+    return item.get('ImageTags', {}).get(image_type)
+
+class StreamingImageBody:
+    """分块上传的请求体：每次迭代都重新流式下载源图片并增量编码（请求重试时可以重新发送）
+
+    提供图片缓存和缓存键时，下载的原始字节同时写入缓存，完整下载后才生效
+    """
+
+    def __init__(self, session: requests.Session, url: str, params: Dict = None,
+                 chunk_size: int = STREAM_CHUNK_SIZE, image_cache=None, cache_key: str = None):
+        self.session = session
+        self.url = url
+        self.params = params
+        self.chunk_size = chunk_size
+        self.image_cache = image_cache
+        self.cache_key = cache_key
+
+    def _tee(self, chunks: Iterable[bytes], writer) -> Iterator[bytes]:
+        for chunk in chunks:
+            writer.write(chunk)
+            yield chunk
+        writer.commit()
+
+    def __iter__(self) -> Iterator[bytes]:
+        with self.session.get(self.url, params=self.params, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            if 'image' not in response.headers.get('Content-Type', ''):
+                raise requests.exceptions.ContentDecodingError(f"源地址不是图片: {self.url}")
+            chunks = response.iter_content(self.chunk_size)
+            if not (self.image_cache and self.cache_key):
+                yield from base64_chunks(chunks)
+                return
+            writer = self.image_cache.writer(self.cache_key)
+            try:
+                yield from base64_chunks(self._tee(chunks, writer))
+            finally:
+                # 下载中断或上传失败时丢弃未完成的缓存条目（已生效时无操作）
+                writer.discard()
+
+class FileImageBody:
+    """分块上传的请求体：从已打开的文件（如图片缓存）分块读取并增量编码，每次迭代从头读取"""
+
+    def __init__(self, file: BinaryIO, chunk_size: int = STREAM_CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+
+    def __iter__(self) -> Iterator[bytes]:
+        self.file.seek(0)
+        yield from base64_chunks(iter(lambda: self.file.read(self.chunk_size), b''))
+
 class EmbyAPI:
     """Emby API 统一接口类"""
     
+    # 进程内所有客户端共用的Emby并发请求上限（多个导入器并行运行时控制对Emby的总压力），None 为不限制
+    _request_slots = None
+    
+    @classmethod
+    def set_global_concurrency(cls, limit: int):
+        """设置进程内所有客户端同时进行的Emby请求数上限（0 为不限制）"""
+        cls._request_slots = threading.BoundedSemaphore(limit) if limit > 0 else None
+    
     def __init__(self, emby_server: str, emby_api_key: str, emby_user_id: str = None):
         self.emby_server = emby_server.rstrip('/')
         self.emby_api_key = emby_api_key
@@ -34,6 +168,20 @@ class EmbyAPI:
             'cache_time': None
         }
         self._cache_duration = 300  # 缓存5分钟
+        
+        # 服务器能力（首次使用时检测）
+        self._server_version = None
+        self._tag_endpoints = None
+        
+        # 请求速率限制（分片执行时每个进程分到全局速率的一部分）
+        self.pacer = RatePacer()
+        
+        # 封面传输选项（服务端缩放、重新压缩），未设置时传输原图
+        self.image_transfer = None
+        # 本地图片缓存（按图片标签寻址），未设置时不缓存
+        self.image_cache = None
+        # 合集封面来源记录（来源图片标签未变化时跳过），未设置时总是上传
+        self.cover_sources = None
     
     def _is_cache_valid(self, cache_type: str) -> bool:
         """检查缓存是否有效"""
@@ -58,15 +206,41 @@ class EmbyAPI:
         self._cache['cache_time'] = time.time()
         logging.info(f"💾 缓存数据: {cache_type}")
     
+    def set_rate_limit(self, requests_per_second: float):
+        """设置本客户端的请求速率上限（每秒请求数，0 为不限制）"""
+        self.pacer = RatePacer(requests_per_second)
+    
+    def set_image_transfer(self, image_transfer):
+        """设置封面传输选项（image_transfer.ImageTransfer）"""
+        self.image_transfer = image_transfer
+    
+    def set_image_cache(self, image_cache):
+        """设置本地图片缓存（image_cache.ImageCache）"""
+        self.image_cache = image_cache
+    
+    def set_cover_sources(self, cover_sources):
+        """设置合集封面来源记录（image_cache.CoverSourceRecord）"""
+        self.cover_sources = cover_sources
+    
+    def _image_params(self, image_type: str) -> Dict:
+        """图片下载时附加的服务端缩放参数"""
+        return self.image_transfer.image_params(image_type) if self.image_transfer else {}
+    
+    def _prepare_image(self, image_content: bytes, image_type: str) -> bytes:
+        """图片上传前的处理（可选重新压缩）"""
+        return self.image_transfer.prepare(image_content, image_type) if self.image_transfer else image_content
+    
     def _make_request(self, method: str, url: str, **kwargs) -> Optional[requests.Response]:
         """统一的请求方法，包含重试机制"""
         max_retries = 3
         retry_delay = 2
         
         for attempt in range(max_retries):
+            self.pacer.wait()
             try:
                 logging.info(f"🔄 尝试第 {attempt + 1} 次请求: {method} {url}")
-                response = self.session.request(method, url, timeout=30, **kwargs)
+                with EmbyAPI._request_slots or contextlib.nullcontext():
+                    response = self.session.request(method, url, timeout=30, **kwargs)
                 logging.info(f"📊 响应状态码: {response.status_code}")
                 
                 # 处理数据库异常
@@ -116,6 +290,48 @@ class EmbyAPI:
             logging.error(f"❌ 检查 Emby 状态失败: {str(e)}")
             return False
     
+    def get_server_version(self) -> Optional[tuple]:
+        """获取Emby服务器版本号，如 (4, 8, 0, 80)"""
+        if self._server_version is None:
+            url = f"{self.emby_server}/emby/System/Info/Public"
+            response = self._make_request('GET', url)
+            if not response:
+                return None
+            try:
+                version = response.json().get('Version', '')
+                self._server_version = tuple(int(part) for part in version.split('.') if part.isdigit())
+                logging.info(f"🔍 Emby 服务器版本: {version}")
+            except ValueError as e:
+                logging.error(f"❌ 解析服务器版本失败: {str(e)}")
+                return None
+        return self._server_version
+    
+    def supports_tag_endpoints(self) -> bool:
+        """服务器是否提供标签增删接口（/Items/{Id}/Tags/Add）"""
+        if self._tag_endpoints is None:
+            version = self.get_server_version()
+            self._tag_endpoints = bool(version) and version >= TAG_ENDPOINT_MIN_VERSION
+        return self._tag_endpoints
+    
+    def add_item_tags(self, item_id: str, tags: List[str]) -> bool:
+        """只提交标签增量，不回传整个项目
+        
+        请求失败时认为服务器不支持该接口，之后的调用直接返回False，由调用方回退到整项提交
+        """
+        if not tags:
+            return True
+        if not self.supports_tag_endpoints():
+            return False
+        
+        url = f"{self.emby_server}/emby/Items/{item_id}/Tags/Add?api_key={self.emby_api_key}"
+        response = self._make_request('POST', url, json={'Tags': [{'Name': tag} for tag in tags]})
+        if response:
+            return True
+        
+        logging.warning("⚠️ 标签增量接口不可用，回退到整项提交")
+        self._tag_endpoints = False
+        return False
+    
     def _extract_series_info(self, name: str) -> tuple:
         """从名称中提取剧集信息和季数
         
@@ -342,42 +558,105 @@ class EmbyAPI:
             logging.error(f"❌ 清空合集失败")
             return False
     
-    def replace_collection_cover(self, collection_id: str, image_url: str) -> bool:
-        """替换合集封面"""
-        try:
-            # 下载图片
-            image_response = requests.get(image_url, timeout=30)
-            if image_response.status_code != 200:
-                logging.error(f"❌ 下载图片失败: {image_response.status_code}")
-                return False
-            
-            # 转换为base64
-            base64_image = base64.b64encode(image_response.content)
-            
-            # 上传到Emby
-            url = f'{self.emby_server}/emby/Items/{collection_id}/Images/Primary?api_key={self.emby_api_key}'
-            headers = {
-                'Content-Type': 'image/jpeg',
-                'X-Emby-Token': self.emby_api_key
-            }
-            
-            logging.info(f"🖼️ 替换合集封面: collection_id={collection_id}")
-            
-            response = self._make_request('POST', url, headers=headers, data=base64_image)
-            if response:
-                if response.status_code == 204:
-                    logging.info(f"✅ 成功替换合集封面 (状态码: 204 - 无内容)")
-                else:
-                    logging.info(f"✅ 成功替换合集封面 (状态码: {response.status_code})")
-                return True
-            else:
-                logging.error(f"❌ 替换合集封面失败")
-                return False
-                
-        except Exception as e:
-            logging.error(f"❌ 替换封面异常: {str(e)}")
-            return False
+    def _stream_uploads(self, image_type: str) -> bool:
+        """是否走流式上传（需要本地重新压缩时必须先拿到完整图片）"""
+        if not self.image_transfer:
+            return True
+        return self.image_transfer.streaming and not self.image_transfer.will_recompress(image_type)
     
+    def download_item_image(self, item_id: str, image_type: str = 'Primary',
+                            image_tag: str = None, params: Dict = None) -> Optional[bytes]:
+        """通过共用会话下载项目的图片，失败返回None；提供图片标签时先查本地缓存
+        
+        params 为服务端缩放参数，默认按传输选项（拼图缩略图等场景可单独指定）
+        """
+        url = f"{self.emby_server}/emby/Items/{item_id}/Images/{image_type}"
+        if params is None:
+            params = self._image_params(image_type)
+        
+        cache_key = None
+        if self.image_cache and image_tag:
+            cache_key = self.image_cache.key(item_id, image_type, image_tag, params)
+            image_content = self.image_cache.get(cache_key)
+            if image_content is not None:
+                logging.info(f"📦 图片缓存命中: item_id={item_id}, type={image_type}")
+                return image_content
+        
+        response = self._make_request('GET', url, params=dict(params, api_key=self.emby_api_key))
+        if not response or 'image' not in response.headers.get('Content-Type', ''):
+            logging.error(f"❌ 下载项目图片失败: item_id={item_id}, type={image_type}")
+            return None
+        if cache_key:
+            self.image_cache.put(cache_key, response.content)
+        return response.content
+
+    def _post_image(self, item_id: str, image_type: str, body) -> bool:
+        """提交base64编码的图片请求体（字节或可迭代的分块）"""
+        url = f"{self.emby_server}/emby/Items/{item_id}/Images/{image_type}"
+        headers = {
+            'Content-Type': 'image/jpeg',
+            'X-Emby-Token': self.emby_api_key
+        }
+        response = self._make_request('POST', url, headers=headers, data=body)
+        if response:
+            logging.info(f"✅ 成功上传项目图片 (状态码: {response.status_code})")
+            return True
+        logging.error(f"❌ 上传项目图片失败: item_id={item_id}, type={image_type}")
+        return False
+
+    def upload_item_image(self, item_id: str, image_type: str, image_content: bytes) -> bool:
+        """上传项目图片（base64编码），成功返回True"""
+        image_content = self._prepare_image(image_content, image_type)
+        logging.info(f"🖼️ 上传项目图片: item_id={item_id}, type={image_type}, {len(image_content)} 字节")
+        return self._post_image(item_id, image_type, base64.b64encode(image_content))
+
+    def upload_item_image_stream(self, item_id: str, image_type: str, source_url: str,
+                                 params: Dict = None, cache_key: str = None) -> bool:
+        """流式上传：边下载源图片边增量base64编码，以分块请求体上传（内存占用与图片大小无关）
+        
+        提供缓存键时边下载边写入本地图片缓存
+        """
+        logging.info(f"🖼️ 流式上传项目图片: item_id={item_id}, type={image_type}")
+        body = StreamingImageBody(self.session, source_url, params, image_cache=self.image_cache, cache_key=cache_key)
+        return self._post_image(item_id, image_type, body)
+
+    def upload_item_image_file(self, item_id: str, image_type: str, file: BinaryIO) -> bool:
+        """流式上传已打开的图片文件（如图片缓存命中的文件），不把整张图片读入内存"""
+        logging.info(f"🖼️ 流式上传项目图片: item_id={item_id}, type={image_type}")
+        return self._post_image(item_id, image_type, FileImageBody(file))
+
+    def copy_item_image(self, source_id: str, target_id: str, image_type: str = 'Primary',
+                        image_tag: str = None) -> bool:
+        """把一个项目的图片复制为另一个项目的同类型图片（按传输选项缩放/压缩）
+        
+        提供源图片标签时：目标图片已经来自同一图片标签则直接跳过（不下载也不上传）；
+        启用了本地缓存时同一张图片只下载一次。流式上传时缓存命中直接从缓存文件读取，
+        未命中时边下载边上传并写入缓存
+        """
+        if self.cover_sources and image_tag and self.cover_sources.unchanged(target_id, image_type, source_id, image_tag):
+            logging.info(f"⏭️ 图片来源未变化，跳过上传: target_id={target_id}, type={image_type}")
+            return True
+        
+        if self._stream_uploads(image_type):
+            params = self._image_params(image_type)
+            cache_key = self.image_cache.key(source_id, image_type, image_tag, params) if self.image_cache and image_tag else None
+            cached_file = self.image_cache.open(cache_key) if cache_key else None
+            if cached_file:
+                logging.info(f"📦 图片缓存命中: item_id={source_id}, type={image_type}")
+                with cached_file:
+                    success = self.upload_item_image_file(target_id, image_type, cached_file)
+            else:
+                url = f"{self.emby_server}/emby/Items/{source_id}/Images/{image_type}"
+                success = self.upload_item_image_stream(target_id, image_type, url,
+                                                        dict(params, api_key=self.emby_api_key), cache_key)
+        else:
+            image_content = self.download_item_image(source_id, image_type, image_tag)
+            success = bool(image_content) and self.upload_item_image(target_id, image_type, image_content)
+        
+        if success and self.cover_sources and image_tag:
+            self.cover_sources.record(target_id, image_type, source_id, image_tag)
+        return success
+
     def get_all_collections(self) -> List[Dict]:
         """获取所有合集"""
         cached_collections = self._get_cached_data('collections')
@@ -402,6 +681,161 @@ class EmbyAPI:
             logging.error(f"❌ JSON解析失败: {str(e)}")
             return []
 
+    
+    def count_items(self, params: Dict) -> Optional[int]:
+        """只查询匹配项目的数量（Limit=0）"""
+        query = dict(params, api_key=self.emby_api_key, Limit=0)
+        response = self._make_request('GET', f"{self.emby_server}/emby/Items", params=query)
+        if not response:
+            return None
+        try:
+            return response.json().get('TotalRecordCount', 0)
+        except ValueError as e:
+            logging.error(f"❌ JSON解析失败: {str(e)}")
+            return None
+    
+    def iter_items(self, params: Dict, page_size: int = 500, start_index: int = 0,
+                   max_items: int = None) -> Iterator[Dict]:
+        """分页查询 /Items，逐个产出项目（同一时间只保留一页数据，适合超大库）
+        
+        start_index / max_items 用于只读取一个范围（分片执行）
+        """
+        url = f"{self.emby_server}/emby/Items"
+        query = dict(params)
+        query['api_key'] = self.emby_api_key
+        query['StartIndex'] = start_index
+        query['Limit'] = page_size if max_items is None else min(page_size, max_items)
+        
+        fetched = 0
+        while True:
+            response = self._make_request('GET', url, params=query)
+            if not response:
+                return
+            
+            try:
+                data = response.json()
+            except ValueError as e:
+                logging.error(f"❌ JSON解析失败: {str(e)}")
+                return
+            
+            page_items = data.get('Items', [])
+            total = data.get('TotalRecordCount', 0) - start_index
+            if max_items is not None:
+                total = min(total, max_items)
+            del data, response
+            fetched += len(page_items)
+            yield from page_items
+            if not page_items or fetched >= total:
+                return
+            query['StartIndex'] += len(page_items)
+            query['Limit'] = min(page_size, total - fetched)
+    
+    def query_items(self, params: Dict, page_size: int = 500) -> List[Dict]:
+        """分页查询 /Items，返回所有匹配项目"""
+        return list(self.iter_items(params, page_size=page_size))
+    
+    def get_item_detail(self, item_id: str) -> Optional[Dict]:
+        """获取单个项目的完整详情（回传整个项目前使用）"""
+        if self.emby_user_id:
+            url = f"{self.emby_server}/emby/Users/{self.emby_user_id}/Items/{item_id}"
+        else:
+            url = f"{self.emby_server}/emby/Items/{item_id}"
+        response = self._make_request('GET', url, params={'Fields': 'ChannelMappingInfo', 'api_key': self.emby_api_key})
+        if not response:
+            return None
+        
+        try:
+            return response.json()
+        except ValueError as e:
+            logging.error(f"❌ JSON解析失败: {str(e)}")
+            return None
+    
+    def get_items_by_ids(self, ids: List[str], fields: str = None,
+                         chunk_size: int = IDS_CHUNK_SIZE) -> Dict[str, Dict]:
+        """按Id批量获取项目（/Items?Ids=a,b,c，按URL长度分块），返回以Id为键的字典
+        
+        配置了用户Id时走用户视图（/Users/{uid}/Items）。返回的是列表视图：只包含基本字段和 fields 中要求的字段，
+        不等同于单个项目详情，不能直接回传给 POST /Items/{Id}（需要完整详情时用 get_item_detail）
+        """
+        if self.emby_user_id:
+            url = f"{self.emby_server}/emby/Users/{self.emby_user_id}/Items"
+        else:
+            url = f"{self.emby_server}/emby/Items"
+        
+        unique_ids = list(dict.fromkeys(ids))
+        items = {}
+        for start in range(0, len(unique_ids), chunk_size):
+            chunk = unique_ids[start:start + chunk_size]
+            params = {'Ids': ','.join(chunk), 'api_key': self.emby_api_key}
+            if fields:
+                params['Fields'] = fields
+            response = self._make_request('GET', url, params=params)
+            if not response:
+                logging.error(f"❌ 批量获取项目详情失败: {len(chunk)} 个项目")
+                continue
+            
+            try:
+                data = response.json()
+            except ValueError as e:
+                logging.error(f"❌ JSON解析失败: {str(e)}")
+                continue
+            
+            for item in data.get('Items', []):
+                items[item['Id']] = item
+        
+        return items
+    
+    def get_genres(self, parent_id: str, item_types: str) -> Optional[List[str]]:
+        """获取库中出现过的类型名称"""
+        url = f"{self.emby_server}/emby/Genres"
+        params = {
+            'ParentId': parent_id,
+            'Recursive': 'true',
+            'IncludeItemTypes': item_types,
+            'api_key': self.emby_api_key
+        }
+        
+        response = self._make_request('GET', url, params=params)
+        if not response:
+            return None
+        
+        try:
+            return [genre['Name'] for genre in response.json().get('Items', [])]
+        except ValueError as e:
+            logging.error(f"❌ JSON解析失败: {str(e)}")
+            return None
+    
+    def get_library_fingerprint(self, parent_id: str, item_types: str) -> Optional[Dict]:
+        """获取库指纹（项目数量 + 最新保存时间 + 最新创建时间），用于判断库是否有变化"""
+        url = f"{self.emby_server}/emby/Items"
+        fingerprint = {}
+        for sort_by, key in [('DateLastSaved', 'newest_saved'), ('DateCreated', 'newest_created')]:
+            params = {
+                'ParentId': parent_id,
+                'Recursive': 'true',
+                'IncludeItemTypes': item_types,
+                'SortBy': sort_by,
+                'SortOrder': 'Descending',
+                'Limit': 1,
+                'Fields': 'DateLastSaved,DateCreated',
+                'api_key': self.emby_api_key
+            }
+            response = self._make_request('GET', url, params=params)
+            if not response:
+                return None
+            
+            try:
+                data = response.json()
+            except ValueError as e:
+                logging.error(f"❌ JSON解析失败: {str(e)}")
+                return None
+            
+            items = data.get('Items', [])
+            fingerprint['count'] = data.get('TotalRecordCount', 0)
+            fingerprint[key] = items[0].get(sort_by) if items else None
+        
+        return fingerprint
+
 
 class RSSHubAPI:
     """RSSHub API 统一接口类"""
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Emby 项目写回缓冲区
+国家标签、类型映射、季节重命名等处理器只登记字段级修改（Tags、Genres、Name、LockedFields），
+刷新时按项目合并：先按Id批量查询跳过没有变化的项目，有变化的项目获取完整详情后只提交一次，
+多个项目并发写回（有并发上限和请求速率）
+预览模式下不写回，而是输出写回计划（项目Id、字段、旧值 -> 新值）和预计请求数；
+实际写回完成后调用登记的回调（如保存增量扫描状态），并告知写回失败的项目
+"""
+import copy
+import math
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from typing import Callable, Dict, List, Optional, Set
+from utils import EmbyAPI, JsonDataBase, RatePacer, ITEM_DIFF_FIELDS, IDS_CHUNK_SIZE
+
+class WriteBackBuffer:
+    """按项目合并字段修改的写回缓冲区"""
+
+    def __init__(self, emby_api: EmbyAPI = None, max_workers: int = 4, requests_per_second: float = 0,
+                 dry_run: bool = False, plan_name: str = None):
+        self.emby_api = emby_api
+        self.max_workers = max_workers
+        self.pacer = RatePacer(requests_per_second)
+        self.dry_run = dry_run
+        self.plan_name = plan_name
+        self._edits = {}
+        self._lock = threading.Lock()
+        self._hold_depth = 0
+        self._flush_callbacks = []
+
+    def _edit(self, item_id: str, label: str = None) -> Dict:
+        edit = self._edits.setdefault(item_id, {
+            'label': label or item_id,
+            'add_tags': [],
+            'genre_map': {},
+            'name': None,
+            'lock_fields': [],
+            'known_locked': None,
+            'before': {}
+        })
+        if label:
+            edit['label'] = label
+        return edit
+
+    def add_tags(self, item_id: str, tags: List[str], label: str = None, locked_fields: List[str] = None,
+                 current_tags: List[str] = None):
+        """登记要追加的标签
+
+        locked_fields 为列表查询得到的项目当前已锁定字段，用于判断能否走标签增量接口；
+        current_tags 为当前标签，用于预览模式输出旧值
+        """
+        with self._lock:
+            edit = self._edit(item_id, label)
+            if locked_fields is not None:
+                edit['known_locked'] = list(locked_fields)
+            if current_tags is not None:
+                edit['before']['Tags'] = list(current_tags)
+            for tag in tags:
+                if tag not in edit['add_tags']:
+                    edit['add_tags'].append(tag)
+
+    def map_genres(self, item_id: str, genre_map: Dict[str, str], label: str = None,
+                   current_genres: List[str] = None):
+        """登记类型映射（旧类型 -> 新类型）"""
+        with self._lock:
+            edit = self._edit(item_id, label)
+            if current_genres is not None:
+                edit['before']['Genres'] = list(current_genres)
+            edit['genre_map'].update(genre_map)
+
+    def set_name(self, item_id: str, name: str, label: str = None, current_name: str = None):
+        """登记新名称"""
+        with self._lock:
+            edit = self._edit(item_id, label)
+            if current_name is not None:
+                edit['before']['Name'] = current_name
+            edit['name'] = name
+
+    def lock_fields(self, item_id: str, fields: List[str], label: str = None):
+        """登记需要锁定的字段"""
+        with self._lock:
+            edit = self._edit(item_id, label)
+            for field in fields:
+                if field not in edit['lock_fields']:
+                    edit['lock_fields'].append(field)
+
+    def after_flush(self, callback: Callable[[Set[str]], None]):
+        """登记一次性回调：下一次实际写回完成后以写回失败的项目Id集合调用（预览模式下丢弃不调用）"""
+        with self._lock:
+            self._flush_callbacks.append(callback)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._edits)
+
+    def hold(self):
+        """暂缓刷新（由主控制器在一轮运行开始时调用），可嵌套"""
+        with self._lock:
+            self._hold_depth += 1
+
+    def release(self) -> Optional[Dict]:
+        """结束暂缓，最外层结束时刷新缓冲区"""
+        with self._lock:
+            self._hold_depth = max(0, self._hold_depth - 1)
+            held = self._hold_depth > 0
+        return None if held else self.flush()
+
+    def flush_if_idle(self) -> Optional[Dict]:
+        """未被暂缓时立即刷新（单独运行某个处理器时使用）"""
+        with self._lock:
+            held = self._hold_depth > 0
+        if held:
+            logging.info(f"📥 写回缓冲区暂缓刷新，当前 {self.pending_count()} 个项目待写回")
+            return None
+        return self.flush()
+
+    @staticmethod
+    def apply_edit(item: Dict, edit: Dict) -> bool:
+        """把登记的修改合并到项目详情中，返回项目是否有变化"""
+        changed = False
+
+        if edit['add_tags']:
+            tag_items = item.setdefault('TagItems', [])
+            tags = item.get('Tags') or [tag['Name'] for tag in tag_items]
+            for tag in edit['add_tags']:
+                if tag not in tags:
+                    tags.append(tag)
+                    tag_items.append({'Name': tag})
+                    changed = True
+            item['Tags'] = tags
+
+        if edit['genre_map']:
+            genre_map = edit['genre_map']
+            new_genres = [genre_map.get(genre, genre) for genre in item.get('Genres', [])]
+            new_genre_items = []
+            for genre_item in item.get('GenreItems', []):
+                if genre_item.get('Name') in genre_map:
+                    genre_item = dict(genre_item, Name=genre_map[genre_item['Name']])
+                new_genre_items.append(genre_item)
+            if new_genres != item.get('Genres', []) or new_genre_items != item.get('GenreItems', []):
+                item['Genres'] = new_genres
+                item['GenreItems'] = new_genre_items
+                changed = True
+
+        if edit['name'] is not None and item.get('Name') != edit['name']:
+            item['Name'] = edit['name']
+            changed = True
+
+        if changed and edit['lock_fields']:
+            locked_fields = item.setdefault('LockedFields', [])
+            for field in edit['lock_fields']:
+                if field not in locked_fields:
+                    locked_fields.append(field)
+
+        return changed
+
+    @staticmethod
+    def is_tag_only(edit: Dict) -> bool:
+        """只追加标签、且需要锁定的字段都已锁定时，不需要回传整个项目"""
+        return (bool(edit['add_tags']) and not edit['genre_map'] and edit['name'] is None
+                and edit['known_locked'] is not None
+                and all(field in edit['known_locked'] for field in edit['lock_fields']))
+
+    def _write_tags(self, item_id: str, edit: Dict) -> bool:
+        """通过标签增量接口写回，失败时返回False由调用方回退到整项提交"""
+        self.pacer.wait()
+        if self.emby_api.add_item_tags(item_id, edit['add_tags']):
+            logging.info(f"✅ 成功写回 {edit['label']} (标签增量)")
+            return True
+        return False
+
+    def _write_item(self, item_id: str, edit: Dict, listed: Optional[Dict]) -> str:
+        """合并修改并提交一次，返回结果（updated/unchanged/failed）
+
+        listed 为批量查询得到的列表视图，合并后没有变化时直接跳过；
+        有变化时获取完整详情再合并提交（列表视图缺少的字段回传后会被清空）
+        """
+        if listed and not self.apply_edit(copy.deepcopy(listed), edit):
+            logging.info(f"📋 {edit['label']} 没有变化，跳过写回")
+            return 'unchanged'
+
+        api = self.emby_api
+        self.pacer.wait()
+        item = api.get_item_detail(item_id)
+        if not item:
+            logging.error(f"❌ 写回失败，获取项目详情失败: {edit['label']}")
+            return 'failed'
+
+        if not self.apply_edit(item, edit):
+            logging.info(f"📋 {edit['label']} 没有变化，跳过写回")
+            return 'unchanged'
+
+        update_url = f"{api.emby_server}/emby/Items/{item_id}?api_key={api.emby_api_key}&reqformat=json"
+        self.pacer.wait()
+        # 通过共享会话的 _make_request 提交（带超时，失败自动重试）
+        update_response = api._make_request('POST', update_url, json=item)
+        if update_response:
+            logging.info(f"✅ 成功写回 {edit['label']}")
+            return 'updated'
+
+        logging.error(f"❌ 写回失败: {edit['label']}")
+        return 'failed'
+
+    def _fetch_details(self, item_ids: List[str]) -> Dict[str, Dict]:
+        """按Id分块批量查询判断修改所需的字段（每块之前节流）"""
+        details = {}
+        for start in range(0, len(item_ids), IDS_CHUNK_SIZE):
+            self.pacer.wait()
+            details.update(self.emby_api.get_items_by_ids(
+                item_ids[start:start + IDS_CHUNK_SIZE], fields=ITEM_DIFF_FIELDS
+            ))
+        return details
+
+    def build_plan(self, edits: Dict[str, Dict]) -> Dict:
+        """生成写回计划：每个项目每个字段的旧值 -> 新值，以及预计请求数"""
+        tag_endpoints = bool(self.emby_api) and self.emby_api.supports_tag_endpoints()
+        changes = []
+        tag_only_count = 0
+        for item_id, edit in edits.items():
+            before = dict(edit['before'])
+            if edit['known_locked'] is not None:
+                before['LockedFields'] = list(edit['known_locked'])
+            item = {
+                'Tags': list(before.get('Tags', [])),
+                'Genres': list(before.get('Genres', [])),
+                'Name': before.get('Name'),
+                'LockedFields': list(before.get('LockedFields', []))
+            }
+            self.apply_edit(item, edit)
+            for field in ['Tags', 'Genres', 'Name', 'LockedFields']:
+                if field in before and item[field] != before[field]:
+                    changes.append({
+                        'item_id': item_id,
+                        'label': edit['label'],
+                        'field': field,
+                        'old': before[field],
+                        'new': item[field]
+                    })
+            if tag_endpoints and self.is_tag_only(edit):
+                tag_only_count += 1
+
+        full_count = len(edits) - tag_only_count
+        detail_batches = math.ceil(full_count / IDS_CHUNK_SIZE)
+        return {
+            'items': len(edits),
+            'changes': changes,
+            'predicted_requests': {
+                'tag_add': tag_only_count,
+                'detail_batches': detail_batches,
+                'detail_gets': full_count,
+                'item_posts': full_count,
+                'total': tag_only_count + detail_batches + full_count * 2
+            }
+        }
+
+    def write_plan(self, edits: Dict[str, Dict]) -> Dict:
+        """预览模式：把写回计划保存到 writeback_plan_{名称}.json"""
+        plan = self.build_plan(edits)
+        plan_db = JsonDataBase(self.plan_name or 'default', 'writeback_plan')
+        plan_db.data = plan
+        plan_db.save()
+        predicted = plan['predicted_requests']
+        logging.info(f"🔍 预览模式 - 写回计划已保存到 {plan_db.file_path}: {plan['items']} 个项目，"
+                     f"{len(plan['changes'])} 处字段修改，预计 {predicted['total']} 次请求")
+        return plan
+
+    def flush(self) -> Dict:
+        """合并写回所有登记的修改（预览模式下只输出写回计划）
+
+        1. 只追加标签的项目先走标签增量接口（新版服务器）
+        2. 其余项目按Id批量查询（每100个一次请求），跳过没有变化的项目
+        3. 有变化的项目逐个获取完整详情，合并修改后提交
+        """
+        with self._lock:
+            edits, self._edits = self._edits, {}
+            callbacks, self._flush_callbacks = self._flush_callbacks, []
+
+        if self.dry_run:
+            stats = {'items': len(edits), 'updated': 0, 'unchanged': 0, 'failed': 0}
+            if edits:
+                stats['plan'] = self.write_plan(edits)
+            return stats
+
+        failed_ids = set()
+        stats = self._write_all(edits, failed_ids)
+        for callback in callbacks:
+            try:
+                callback(failed_ids)
+            except Exception as e:
+                logging.error(f"❌ 写回完成回调异常: {str(e)}")
+        return stats
+
+    def _write_all(self, edits: Dict[str, Dict], failed_ids: Set[str]) -> Dict:
+        """写回所有修改，写回失败的项目Id加入 failed_ids"""
+        stats = {'items': len(edits), 'updated': 0, 'unchanged': 0, 'failed': 0}
+        if not edits:
+            return stats
+
+        if not self.emby_api:
+            logging.error(f"❌ 写回缓冲区未绑定Emby客户端，丢弃 {len(edits)} 个项目的修改")
+            stats['failed'] = len(edits)
+            failed_ids.update(edits)
+            return stats
+
+        logging.info(f"📤 开始写回 {len(edits)} 个项目 (并发: {self.max_workers})")
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            remaining = dict(edits)
+            tag_only = [item_id for item_id, edit in edits.items() if self.is_tag_only(edit)]
+            if tag_only and self.emby_api.supports_tag_endpoints():
+                futures = {item_id: executor.submit(self._write_tags, item_id, edits[item_id]) for item_id in tag_only}
+                for item_id, future in futures.items():
+                    try:
+                        if future.result():
+                            stats['updated'] += 1
+                            del remaining[item_id]
+                    except Exception as e:
+                        logging.error(f"❌ 标签增量写回异常: {str(e)}")
+
+            details = self._fetch_details(list(remaining)) if remaining else {}
+            futures = {
+                item_id: executor.submit(self._write_item, item_id, edit, details.get(item_id))
+                for item_id, edit in remaining.items()
+            }
+            for item_id, future in futures.items():
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error(f"❌ 写回异常: {str(e)}")
+                    result = 'failed'
+                stats[result] += 1
+                if result == 'failed':
+                    failed_ids.add(item_id)
+
+        logging.info(f"📤 写回完成: 更新 {stats['updated']}，无变化 {stats['unchanged']}，失败 {stats['failed']}")
+        return stats
+
+_shared_buffer = WriteBackBuffer()
+
+def get_write_buffer(emby_api: EmbyAPI = None, max_workers: int = None,
+                     requests_per_second: float = None) -> WriteBackBuffer:
+    """获取进程内共享的写回缓冲区，首次传入的Emby客户端用于写回"""
+    if emby_api and not _shared_buffer.emby_api:
+        _shared_buffer.emby_api = emby_api
+    if max_workers:
+        _shared_buffer.max_workers = max_workers
+    if requests_per_second is not None:
+        _shared_buffer.pacer = RatePacer(requests_per_second)
+    return _shared_buffer
+
+def get_write_buffer_from_config(config: ConfigParser, emby_api: EmbyAPI, section: str,
+                                 plan_name: str) -> WriteBackBuffer:
+    """按配置获取写回缓冲区
+
+    处理器为预览模式（[section] dry_run）时返回独立的预览缓冲区，只输出写回计划；
+    否则返回共享缓冲区，并发数和请求速率读取 [WriteBack]
+    """
+    max_workers = config.getint('WriteBack', 'max_concurrency', fallback=4)
+    requests_per_second = config.getfloat('WriteBack', 'requests_per_second', fallback=0)
+    if config.getboolean(section, 'dry_run', fallback=True):
+        return WriteBackBuffer(emby_api, max_workers=max_workers, dry_run=True, plan_name=plan_name)
+    return get_write_buffer(emby_api, max_workers=max_workers, requests_per_second=requests_per_second)